@@ -0,0 +1,92 @@
+"""
+Benchmark of the area selection filter: IntersectionEngine against native:extractbylocation.
+
+Run from the QGIS Python console:
+    path = '/path/to/SiKataster/benchmarks/bench_area_intersection.py'
+    exec(open(path).read(), {'__file__': path})
+
+A synthetic grid of square parcels is intersected with a buffered diagonal
+corridor and with a scattered multi-part selection. No network access is needed.
+"""
+
+import importlib.util
+import os
+import time
+
+import processing
+from qgis.core import QgsFeature, QgsGeometry, QgsPointXY, QgsRectangle, QgsVectorLayer
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+spec = importlib.util.spec_from_file_location('si_kataster_geometry', os.path.join(PLUGIN_DIR, 'si_kataster_geometry.py'))
+si_kataster_geometry = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(si_kataster_geometry)
+
+CRS = 'EPSG:3794'
+PARCEL_SIZE = 20
+
+
+def parcel_layer(rows, columns):
+    layer = QgsVectorLayer(f'Polygon?crs={CRS}&field=ST_PARCELE:string', 'parcele', 'memory')
+    features = []
+    for row in range(rows):
+        for column in range(columns):
+            x, y = 400000 + column * PARCEL_SIZE, 100000 + row * PARCEL_SIZE
+            feature = QgsFeature(layer.fields())
+            feature.setGeometry(QgsGeometry.fromRect(QgsRectangle(x, y, x + PARCEL_SIZE, y + PARCEL_SIZE)))
+            feature.setAttributes([f'{row}/{column}'])
+            features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+def corridor_selection(rows, columns):
+    start = QgsPointXY(400000, 100000)
+    end = QgsPointXY(400000 + columns * PARCEL_SIZE, 100000 + rows * PARCEL_SIZE)
+    return QgsGeometry.fromPolylineXY([start, end]).buffer(PARCEL_SIZE * 2, 5)
+
+
+def scattered_selection(rows, columns, count=200):
+    parts = []
+    for i in range(count):
+        x = 400000 + (i * 7919 % columns) * PARCEL_SIZE
+        y = 100000 + (i * 104729 % rows) * PARCEL_SIZE
+        parts.append(QgsGeometry.fromPointXY(QgsPointXY(x, y)).buffer(PARCEL_SIZE * 3, 8))
+    return QgsGeometry.unaryUnion(parts)
+
+
+def selection_layer(geometry):
+    layer = QgsVectorLayer(f'Polygon?crs={CRS}', 'presek', 'memory')
+    feature = QgsFeature()
+    feature.setGeometry(geometry)
+    layer.dataProvider().addFeature(feature)
+    return layer
+
+
+def with_processing(parcels, selection):
+    result = processing.run('native:extractbylocation', {
+        'INPUT': parcels,
+        'PREDICATE': [0],
+        'INTERSECT': selection_layer(selection),
+        'OUTPUT': 'TEMPORARY_OUTPUT'
+    })['OUTPUT']
+    return result.featureCount()
+
+
+def with_engine(parcels, selection):
+    engine = si_kataster_geometry.IntersectionEngine(selection)
+    return sum(1 for _ in engine.filter_features(parcels.getFeatures()))
+
+
+def run(rows=500, columns=500):
+    parcels = parcel_layer(rows, columns)
+    for name, selection in (('koridor', corridor_selection(rows, columns)),
+                            ('razpršen izbor', scattered_selection(rows, columns))):
+        for method in (with_processing, with_engine):
+            start_time = time.time()
+            count = method(parcels, selection)
+            print(f"{name:15} {method.__name__:16} {count:8d} parcel {time.time() - start_time:8.2f}s")
+
+
+if __name__ in ('__main__', '__console__', 'builtins'):
+    run()
@@ -1,15 +1,33 @@
-from qgis.PyQt.QtCore import QThread, pyqtSignal
-from qgis.core import QgsCoordinateReferenceSystem, QgsVectorLayer, QgsMessageLog, Qgis, QgsAbstractMetadataBase, QgsApplication, QgsTask, QgsMessageLog, QgsNetworkAccessManager,QgsProject, QgsLayerDefinition
+from qgis.PyQt.QtCore import QThread, pyqtSignal, pyqtSlot
+from qgis.core import QgsCoordinateReferenceSystem, QgsVectorLayer, QgsMessageLog, Qgis, QgsApplication, QgsTask, QgsMessageLog, QgsNetworkAccessManager,QgsProject, QgsLayerDefinition, QgsJsonUtils, QgsGeometry, QgsRectangle, QgsFeature, QgsFeatureRequest, QgsVectorFileWriter, QgsWkbTypes, QgsCoordinateTransformContext
 from qgis.PyQt.QtGui import QColor
-import processing
 from qgis.core import QgsNetworkAccessManager
-from qgis.PyQt.QtCore import QUrl, QEventLoop, QCoreApplication
+from qgis.PyQt.QtCore import QUrl, QEventLoop, QCoreApplication, Qt
 from qgis.PyQt.QtNetwork import QNetworkRequest
 from qgis.utils import iface
 import os
+import re
 import csv
 import requests  
+import json
+import time
+from collections import namedtuple
+from itertools import chain, islice
+import math
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from urllib.parse import urlencode
+
+from .si_kataster_cache import wfs_cache
+from .si_kataster_geojson import GeoJsonFeatureStream
+from .si_kataster_geometry import SelectionGeometrySource, IntersectionEngine, prepare_selection_geometry
+from .si_kataster_http import GursHttpClient, RequestCanceledError, abort_response
+from .si_kataster_metadata import ProvenanceBuilder
+from .si_kataster_mirror import parcel_mirror, parcel_snapshot, local_store_for_ko, local_store_for_area
+from .si_kataster_journal import download_journals
+from .si_kataster_parcels import ParcelNumberIndex, parcel_number_cache
+from .si_kataster_progress import WfsFeedback
+from .si_kataster_settings import setting_value, plugin_profile_dir
 
 
 MESSAGE_CATEGORY = 'SiKataster'
@@ -25,7 +43,7 @@ def is_wfs_accessible():
     
     try:
         # Use HEAD request to check if the server is accessible without downloading the content
-        response = requests.head(wfs_url, timeout=3)
+        response = GursHttpClient.head(wfs_url, retries=0, probe=True, timeout=3)
         if response.status_code == 200:
             return True  # Server is accessible
         else:
@@ -38,14 +56,40 @@ def is_wfs_accessible():
         return False  # Catch all other exceptions
 
 
-def  connect_to_wfs(return_type, typeName=None, propertyName=None, cql_filter=None, bbox=None):
-    wfs_url = "https://ipi.eprostor.gov.si/wfs-si-gurs-kn/wfs"
+WFS_URL = "https://ipi.eprostor.gov.si/wfs-si-gurs-kn/wfs"
+WFS_PAGE_SIZE = 20000
+WFS_CRS = "EPSG:3794"
+WFS_BATCH_SIZE = 1000
+WFS_CHUNK_SIZE = 65536
+WFS_MAX_GET_LENGTH = 6000
+WFS_MAX_FILTER_LENGTH = 60000
+SCRATCH_BATCH_SIZE = 5000
+AREA_MAX_TILES = 400
+# a failed DescribeFeatureType is not repeated for this many seconds
+WFS_DESCRIBE_RETRY_S = 300
+
+
+class WfsError(Exception):
+    pass
+
+
+class WfsCanceledError(WfsError):
+    pass
+
+
+def check_canceled(feedback):
+    """Raise WfsCanceledError once feedback is canceled"""
+    if feedback is not None and feedback.isCanceled():
+        raise WfsCanceledError(tr('Prenos preklican'))
+
+
+def build_wfs_params(typeName=None, propertyName=None, cql_filter=None, bbox=None):
     params = {
         'service': 'WFS',
         'version': '2.0.0',
         'request': 'GetFeature',
         'pagingEnabled':'true',
-        'pageSize':'20000',
+        'pageSize':str(WFS_PAGE_SIZE),
         'restrictToRequestBBOX':'1'
     }
 
@@ -58,126 +102,717 @@ def  connect_to_wfs(return_type, typeName=None, propertyName=None, cql_filter=No
         params["CQL_FILTER"] = cql_filter
     if bbox:
         params["BBOX"] = bbox
-    all_features = []
-    if return_type == 'json':
-        params["outputFormat"] = "application/json"
+    return params
+
+
+def parse_number_matched(data):
+    """Return numberMatched of a GeoJSON FeatureCollection, None if the server does not know it."""
+    number_matched = data.get('numberMatched', data.get('totalFeatures'))
+    try:
+        return int(number_matched)
+    except (TypeError, ValueError):
+        return None
+
+
+WfsPage = namedtuple('WfsPage', ['features', 'number_matched', 'elapsed', 'etag', 'last_modified', 'not_modified'])
+
+
+class WfsPageStream:
+    """One GetFeature page, decoded feature by feature while it downloads.
+
+    number_matched, count and elapsed are known once iteration has finished.
+    Canceling feedback shuts the socket down, so a blocked read returns at
+    once and iteration ends with WfsCanceledError.
+    """
+
+    def __init__(self, params, start_index, page_size, headers=None, feedback=None):
+        page_params = dict(params)
+        page_params["count"] = str(page_size)
+        page_params["startIndex"] = str(start_index)
+        self.start_time = time.time()
+        self.number_matched = None
+        self.count = 0
+        self.elapsed = 0
+        self.feedback = feedback
+        check_canceled(feedback)
         try:
-            response = requests.get(wfs_url, params=params, timeout=10)
+            if len(urlencode(page_params)) > WFS_MAX_GET_LENGTH:
+                # Long filters (e.g. INTERSECTS with a polygon) do not fit into a URL
+                self.response = GursHttpClient.post(WFS_URL, data=page_params, headers=headers, stream=True, timeout=10, feedback=feedback)
+            else:
+                self.response = GursHttpClient.get(WFS_URL, params=page_params, headers=headers, stream=True, timeout=10, feedback=feedback)
+            self.not_modified = self.response.status_code == 304
+            if not self.not_modified:
+                try:
+                    self.response.raise_for_status()
+                except requests.HTTPError:
+                    # frees the rate limiter slot held by the streamed response
+                    self.response.close()
+                    raise
+        except RequestCanceledError as e:
+            raise WfsCanceledError(tr('Prenos preklican')) from e
+        except requests.RequestException as e:
+            raise WfsError(tr(f'Server {WFS_URL} je nedostopen')) from e
+        self.etag = self.response.headers.get('ETag')
+        self.last_modified = self.response.headers.get('Last-Modified')
+        if feedback is not None:
+            # direct, the page is read on a worker thread without an event loop
+            feedback.canceled.connect(self.abort, Qt.DirectConnection)
+            if feedback.isCanceled():
+                self.abort()
+
+    def abort(self):
+        abort_response(self.response)
+
+    def _chunks(self):
+        for chunk in self.response.iter_content(chunk_size=WFS_CHUNK_SIZE):
+            check_canceled(self.feedback)
+            if self.feedback is not None:
+                self.feedback.add_bytes(len(chunk))
+            yield chunk
+
+    def __iter__(self):
+        try:
+            if self.not_modified:
+                return
+            stream = GeoJsonFeatureStream(self._chunks())
+            try:
+                for feature in stream:
+                    self.count += 1
+                    if self.feedback is not None:
+                        self.feedback.add_features()
+                    yield feature
+                # a shut down socket may look like the end of the body
+                check_canceled(self.feedback)
+            except WfsCanceledError:
+                raise
+            except Exception as e:
+                check_canceled(self.feedback)
+                if isinstance(e, (requests.RequestException, ValueError)):
+                    raise WfsError(tr(f'Server {WFS_URL} je nedostopen')) from e
+                raise
+        finally:
+            if self.feedback is not None:
+                try:
+                    self.feedback.canceled.disconnect(self.abort)
+                except TypeError:
+                    pass
+            self.response.close()
+        self.number_matched = parse_number_matched(stream.members)
+        self.elapsed = time.time() - self.start_time
+
+
+def fetch_wfs_page(params, start_index, page_size, headers=None, feedback=None):
+    """Fetch one whole GetFeature page as a WfsPage."""
+    stream = WfsPageStream(params, start_index, page_size, headers=headers, feedback=feedback)
+    features = list(stream)
+    return WfsPage(features, stream.number_matched, stream.elapsed, stream.etag, stream.last_modified, stream.not_modified)
+
+
+def fetch_journaled_page(params, start_index, page_size, journal=None, feedback=None):
+    """fetch_wfs_page, served from journal if the page is complete there, else recorded in it"""
+    if journal is not None and journal.has(start_index):
+        features = journal.read(start_index)
+        if feedback is not None:
+            feedback.add_features(len(features))
+        return WfsPage(features, journal.number_matched, 0, None, None, False)
+    page = fetch_wfs_page(params, start_index, page_size, feedback=feedback)
+    if journal is not None:
+        journal.commit(start_index, page.features)
+    return page
+
+
+def iter_page_batches(stream, batch_size=WFS_BATCH_SIZE):
+    """Group a streamed page into lists of at most batch_size features"""
+    batch = []
+    for feature in stream:
+        batch.append(feature)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def log_page_timing(typeName, start_index, count, elapsed):
+    QgsMessageLog.logMessage(
+        f"WFS {typeName}: startIndex={start_index}, {count} elementov v {elapsed:.2f}s",
+        MESSAGE_CATEGORY,
+        Qgis.Info
+    )
+
+
+def iter_wfs_pages(typeName=None, propertyName=None, cql_filter=None, bbox=None, page_size=WFS_PAGE_SIZE, max_workers=None,
+                   request_headers=None, page_info=None, feedback=None, journal=None):
+    """Walk a GetFeature result with startIndex/count and yield lists of features.
+
+    Pages read serially are decoded while they download and yielded in
+    batches of WFS_BATCH_SIZE features. Once the first page reports
+    numberMatched, the remaining pages are fetched over a pool of max_workers
+    threads (setting wfs/max_workers) and yielded whole, in order. At most
+    max_workers pages are held in memory ahead of the consumer. Without
+    numberMatched paging is serial and stops at the first short page.
+    With numberMatched paging continues until it is reached, advancing by the
+    features actually returned: a server capping count below page_size
+    (e.g. GeoServer maxFeatures) sets the page step with its first page.
+
+    request_headers are sent with the first page only (conditional requests),
+    page_info, if given, is filled with the validators of the first page and
+    'not_modified' when the server answered 304.
+    Raises WfsError when the server cannot be reached and WfsCanceledError
+    once feedback (a WfsFeedback) is canceled, pages still downloading are
+    aborted. Bytes, features and pages are reported to feedback as they arrive.
+
+    With a DownloadJournal every completed page of a multi-page result is
+    recorded; a journal that already knows numberMatched is resumed, its
+    pages are replayed and only the missing ones are downloaded. The caller
+    calls journal.finish() once the result has been consumed.
+    """
+    params = build_wfs_params(typeName, propertyName, cql_filter, bbox)
+    params["outputFormat"] = "application/json"
+    if max_workers is None:
+        max_workers = setting_value('wfs/max_workers')
+    max_workers = max(1, int(max_workers))
+    if page_info is None:
+        page_info = {}
+
+    if journal is not None and journal.number_matched is not None:
+        # Resume, every page comes from the journal or the server
+        start_index, number_matched = 0, journal.number_matched
+        page_step = journal.page_step or page_size
+        page_info['pages'] = 0
+        if feedback is not None:
+            feedback.expect_features(number_matched)
+    else:
+        first_page = WfsPageStream(params, 0, page_size, headers=request_headers, feedback=feedback)
+        page_info.update(etag=first_page.etag, last_modified=first_page.last_modified,
+                         not_modified=first_page.not_modified, pages=1)
+        first_features = [] if journal is not None else None
+        for batch in iter_page_batches(first_page):
+            if first_features is not None:
+                first_features.extend(batch)
+            yield batch
+        if first_page.not_modified:
+            return
+        log_page_timing(typeName, 0, first_page.count, first_page.elapsed)
+        start_index, number_matched = first_page.count, first_page.number_matched
+        if number_matched is None:
+            complete = first_page.count < page_size
+        else:
+            complete = first_page.count == 0 or first_page.count >= number_matched
+        if complete:
+            if feedback is not None:
+                feedback.expect_features(first_page.count)
+                feedback.page_done()
+            return
+        # the server may cap count below page_size
+        page_step = first_page.count
+        if journal is not None and number_matched is not None:
+            journal.commit(0, first_features, number_matched=number_matched, page_step=page_step)
+        del first_features
+        if feedback is not None:
+            feedback.expect_features(number_matched or 0)
+            feedback.page_done()
+
+    if number_matched is None or (max_workers == 1 and journal is None):
+        while number_matched is None or start_index < number_matched:
+            page = WfsPageStream(params, start_index, page_size, feedback=feedback)
+            page_info['pages'] += 1
+            yield from iter_page_batches(page)
+            log_page_timing(typeName, start_index, page.count, page.elapsed)
+            if feedback is not None:
+                feedback.page_done()
+            start_index += page.count
+            if page.count == 0 or (number_matched is None and page.count < page_size):
+                break
+        return
+
+    start_indexes = iter(range(start_index, number_matched, page_step))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = []
+        try:
+            for next_index in start_indexes:
+                pending.append((next_index, executor.submit(fetch_journaled_page, params, next_index, page_step, journal, feedback)))
+                if len(pending) >= max_workers:
+                    break
+            while pending:
+                page_index, future = pending.pop(0)
+                page = future.result()
+                check_canceled(feedback)
+                page_info['pages'] += 1
+                log_page_timing(typeName, page_index, len(page.features), page.elapsed)
+                if feedback is not None:
+                    feedback.page_done()
+                next_index = next(start_indexes, None)
+                if next_index is not None:
+                    pending.append((next_index, executor.submit(fetch_journaled_page, params, next_index, page_step, journal, feedback)))
+                expected = min(page_step, number_matched - page_index)
+                received = len(page.features)
+                if page.features:
+                    yield page.features
+                del page
+                # a page shorter than the step leaves a gap before the next one
+                while received < expected:
+                    gap = fetch_wfs_page(params, page_index + received, expected - received, feedback=feedback)
+                    if not gap.features:
+                        raise WfsError(tr(f'Server {WFS_URL} je vrnil nepopoln rezultat'))
+                    received += len(gap.features)
+                    yield gap.features
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def iter_wfs_features(typeName=None, propertyName=None, cql_filter=None, bbox=None, page_size=WFS_PAGE_SIZE, max_workers=None, use_cache=True,
+                      feedback=None):
+    """Yield GeoJSON features one by one in server order.
+
+    Results are served from the on-disk WFS cache while fresh. Expired entries
+    of single page results are revalidated with ETag/Last-Modified, everything
+    else is downloaded again and written to the cache as it streams.
+    """
+    if not use_cache or not wfs_cache.enabled():
+        for page in iter_wfs_pages(typeName, propertyName, cql_filter, bbox, page_size, max_workers, feedback=feedback):
+            yield from page
+        return
+
+    key = wfs_cache.key(typeName, propertyName, cql_filter, bbox)
+    # an entry evicted by another task before it is opened is a miss
+    entry = wfs_cache.open(key)
+    meta, cached_file = entry if entry is not None else (None, None)
+    try:
+        if meta and wfs_cache.is_fresh(meta):
+            yield from iter_cached_features(meta, cached_file, feedback)
+            return
+
+        request_headers = wfs_cache.validator_headers(meta) if meta else None
+        page_info = {}
+        writer = wfs_cache.writer(key)
+        try:
+            for page in iter_wfs_pages(typeName, propertyName, cql_filter, bbox, page_size, max_workers,
+                                       request_headers=request_headers, page_info=page_info, feedback=feedback):
+                writer.write(page)
+                yield from page
+        except BaseException:
+            writer.discard()
+            raise
+
+        if not page_info.get('not_modified') and cached_file is not None:
+            # the new entry replaces the stale one, which must not be open on Windows
+            cached_file.close()
+        if page_info.get('not_modified'):
+            # the entry stays open, so it is served even if it was evicted meanwhile
+            writer.discard()
+            wfs_cache.renew(key, meta)
+            yield from iter_cached_features(meta, cached_file, feedback)
+        elif page_info.get('pages') == 1:
+            writer.commit(etag=page_info.get('etag'), last_modified=page_info.get('last_modified'))
+        else:
+            # Validators of the first page say nothing about the following pages
+            writer.commit()
+    finally:
+        if cached_file is not None:
+            cached_file.close()
+
+
+def iter_cached_features(meta, cached_file, feedback=None):
+    """Yield the features of a cache entry opened with wfs_cache.open, reporting them to feedback"""
+    if feedback is None:
+        yield from wfs_cache.read(cached_file)
+        return
+    feedback.expect_features(meta.get('feature_count') or 0)
+    for feature in wfs_cache.read(cached_file):
+        check_canceled(feedback)
+        feedback.add_features()
+        yield feature
+
+
+WFS_GEOMETRY_COLUMNS = {}
+WFS_GEOMETRY_COLUMN_FAILURES = {}
+
+
+def wfs_geometry_column(typeName):
+    """Name of the geometry property of a feature type from DescribeFeatureType, None if unknown.
+
+    A failed lookup is remembered for WFS_DESCRIBE_RETRY_S, so tiles fall back
+    to BBOX queries without asking again each time.
+    """
+    if typeName not in WFS_GEOMETRY_COLUMNS:
+        if time.time() - WFS_GEOMETRY_COLUMN_FAILURES.get(typeName, 0) < WFS_DESCRIBE_RETRY_S:
+            return None
+        params = {
+            'service': 'WFS',
+            'version': '2.0.0',
+            'request': 'DescribeFeatureType',
+            'typeName': typeName,
+            'outputFormat': 'application/json'
+        }
+        try:
+            response = GursHttpClient.get(WFS_URL, params=params, timeout=10)
             response.raise_for_status()
-            data = response.json()
-            features = data.get('features', [])
-            all_features.extend(features)
-        except (requests.RequestException, requests.ConnectionError) as e:
-                return {'error': tr(f'Server {wfs_url} je nedostopen')}
-     
+            properties = response.json()['featureTypes'][0]['properties']
+        except (requests.RequestException, ValueError, KeyError, IndexError):
+            WFS_GEOMETRY_COLUMN_FAILURES[typeName] = time.time()
+            return None
+        WFS_GEOMETRY_COLUMNS[typeName] = next(
+            (prop['name'] for prop in properties if str(prop.get('type', '')).startswith('gml:')), None)
+    return WFS_GEOMETRY_COLUMNS[typeName]
+
+
+def intersects_cql_filter(typeName, geometry):
+    """CQL INTERSECTS filter for a selection geometry in EPSG:3794.
+
+    The geometry is simplified until its WKT fits into WFS_MAX_FILTER_LENGTH
+    and then grown by the simplification tolerance, so the filter selects a
+    superset of the parcels touching the original geometry. Returns None when
+    the geometry stays too complex or the geometry column is unknown, the
+    caller then falls back to a BBOX query.
+    """
+    geometry_column = wfs_geometry_column(typeName)
+    if not geometry_column or geometry.isEmpty():
+        return None
+    extent = geometry.boundingBox()
+    tolerance = 0
+    for _ in range(8):
+        if tolerance:
+            filter_geometry = geometry.simplify(tolerance).buffer(tolerance + 0.01, 2)
+        else:
+            filter_geometry = geometry
+        wkt = filter_geometry.asWkt(2)
+        if filter_geometry.isGeosValid() and len(wkt) <= WFS_MAX_FILTER_LENGTH:
+            return f"INTERSECTS({geometry_column},{wkt})"
+        tolerance = max(extent.width(), extent.height()) / 10000 if not tolerance else tolerance * 4
+    return None
+
+
+def area_tiles(geometry, tile_size):
+    """Split geometry along a square grid and yield the non-empty pieces.
+
+    Tiles that do not touch the geometry are skipped, so a long corridor only
+    produces tiles along its course. The tile size is doubled until there are
+    at most AREA_MAX_TILES grid cells.
+    """
+    extent = geometry.boundingBox()
+    while math.ceil(extent.width() / tile_size) * math.ceil(extent.height() / tile_size) > AREA_MAX_TILES:
+        tile_size *= 2
+    columns = max(1, math.ceil(extent.width() / tile_size))
+    rows = max(1, math.ceil(extent.height() / tile_size))
+    if columns == 1 and rows == 1:
+        yield geometry
+        return
+
+    engine = QgsGeometry.createGeometryEngine(geometry.constGet())
+    engine.prepareGeometry()
+    for row in range(rows):
+        for column in range(columns):
+            x_min = extent.xMinimum() + column * tile_size
+            y_min = extent.yMinimum() + row * tile_size
+            tile = QgsGeometry.fromRect(QgsRectangle(x_min, y_min, x_min + tile_size, y_min + tile_size))
+            if not engine.intersects(tile.constGet()):
+                continue
+            piece = geometry.intersection(tile)
+            if not piece.isEmpty():
+                yield piece
+
+
+def parcel_identity(feature):
+    """Identity of a GeoJSON parcel feature, used to drop duplicates from neighbouring tiles"""
+    properties = feature.get('properties') or {}
+    if properties.get('EID_PARCELA'):
+        return properties['EID_PARCELA']
+    if feature.get('id'):
+        return feature['id']
+    return properties.get('KO_ID'), properties.get('ST_PARCELE')
+
+
+def wfs_bbox(extent):
+    """BBOX parameter of a QgsRectangle"""
+    return f"{extent.xMinimum()},{extent.yMinimum()},{extent.xMaximum()},{extent.yMaximum()}"
+
+
+def fetch_area_tile(typeName, geometry, feedback=None, use_cache=True):
+    """All features of typeName touching one tile, INTERSECTS filtered where possible, else by BBOX"""
+    check_canceled(feedback)
+    cql_filter = intersects_cql_filter(typeName, geometry)
+    if cql_filter:
+        return list(iter_wfs_features(typeName=typeName, cql_filter=cql_filter, max_workers=1, use_cache=use_cache, feedback=feedback))
+    return list(iter_wfs_features(typeName=typeName, bbox=wfs_bbox(geometry.boundingBox()), max_workers=1, use_cache=use_cache, feedback=feedback))
+
+
+def fetch_journaled_tile(typeName, tile_index, geometry, journal=None, feedback=None):
+    """fetch_area_tile, served from journal if the tile is complete there, else recorded in it"""
+    if journal is not None and journal.has(tile_index):
+        features = journal.read(tile_index)
+        if feedback is not None:
+            feedback.add_features(len(features))
+        return features
+    # a recorded tile lives in the journal, keep it out of the WFS cache
+    features = fetch_area_tile(typeName, geometry, feedback, use_cache=journal is None)
+    if journal is not None:
+        journal.commit(tile_index, features)
+    return features
+
+
+def iter_area_features(typeName, geometry, max_workers=None, feedback=None, journal=None):
+    """Yield the features of typeName touching a geometry in EPSG:3794, each one once.
+
+    The geometry is split into tiles of area/tile_size_m (see area_tiles),
+    the tiles are fetched over max_workers threads (setting wfs/max_workers)
+    and features on tile borders are deduplicated with parcel_identity.
+    Completed tiles are reported to feedback. With a DownloadJournal
+    completed tiles are recorded and replayed when the same area is fetched
+    again, see iter_wfs_pages.
+    """
+    if max_workers is None:
+        max_workers = setting_value('wfs/max_workers')
+    max_workers = max(1, int(max_workers))
+    tiles = list(area_tiles(geometry, setting_value('area/tile_size_m')))
+    if feedback is not None:
+        feedback.expect_tiles(len(tiles))
+    tiles = iter(enumerate(tiles))
+    seen = set()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = [executor.submit(fetch_journaled_tile, typeName, index, tile, journal, feedback) for index, tile in islice(tiles, max_workers)]
+        try:
+            while pending:
+                features = pending.pop(0).result()
+                check_canceled(feedback)
+                if feedback is not None:
+                    feedback.tile_done()
+                next_tile = next(tiles, None)
+                if next_tile is not None:
+                    pending.append(executor.submit(fetch_journaled_tile, typeName, *next_tile, journal, feedback))
+                for feature in features:
+                    identity = parcel_identity(feature)
+                    if identity not in seen:
+                        seen.add(identity)
+                        yield feature
+                del features
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def wfs_request_url(typeName=None, propertyName=None, cql_filter=None, bbox=None):
+    params = build_wfs_params(typeName, propertyName, cql_filter, bbox)
+    return f"{WFS_URL}?{'&'.join(f'{key}={value}' for key, value in params.items())}"
+
+
+def  connect_to_wfs(return_type, typeName=None, propertyName=None, cql_filter=None, bbox=None, feedback=None):
+    if return_type == 'iter':
+        return iter_wfs_features(typeName, propertyName, cql_filter, bbox, feedback=feedback)
+
+    elif return_type == 'json':
+        try:
+            all_features = list(iter_wfs_features(typeName, propertyName, cql_filter, bbox, feedback=feedback))
+        except WfsError as e:
+            return {'error': str(e)}
         return {'features': all_features}
 
     elif return_type == 'layer':
-        # Return as a WFS layer directly (no pagination needed)
-        url = f"{wfs_url}?{'&'.join(f'{key}={value}' for key, value in params.items())}"
-        wfs_layer = QgsVectorLayer(url, typeName, "WFS")
+        # Return as a WFS layer directly, the WFS provider pages on its own
+        wfs_layer = QgsVectorLayer(wfs_request_url(typeName, propertyName, cql_filter, bbox), typeName, "WFS")
         return wfs_layer
 
 class LayerMetadataManager:
+    """Provenance of plugin layers, built with ProvenanceBuilder and applied without edit sessions"""
+
     def __init__(self):
         self.tr = tr
-        pass
+
+    def provenance(self, layer=None):
+        """New ProvenanceBuilder, starting from the metadata of layer if given"""
+        return ProvenanceBuilder.from_layer(layer) if layer is not None else ProvenanceBuilder()
 
     def transfer_metadata(self, source_layer, target_layer):
-        target_layer.startEditing()
-        source_metadata = source_layer.metadata()
-        target_layer.setMetadata(source_metadata)
-        target_layer.commitChanges()
+        target_layer.setMetadata(source_layer.metadata())
 
     def update_history(self, layer, history):
-        layer.startEditing()
-        metadata = layer.metadata()
-        metadata.addHistoryItem(str(history))
-        layer.setMetadata(metadata)
-        layer.commitChanges()
-
-    def update_metadata(self, layer, link_type):
-        time_now = datetime.now()
-        history = {
-            'timestamp': time_now.isoformat(),
-            'process': 'prevzem sloja',
-            'title': layer.name(),
-            'source': layer.publicSource()
-        }
-        self.update_history(layer, history)
+        self.provenance(layer).add_history(history).apply(layer)
 
-        description = self.tr('Dostop') + ': ' + str(time_now)
-        name = self.tr('Vir podatkov')
-        link = QgsAbstractMetadataBase.Link(name=name, type=link_type, url=layer.publicSource())
-        link.description = description
-
-        layer.startEditing()
-        layer_metadata = layer.metadata()
-        layer_metadata.addLink(link)
-        layer.setMetadata(layer_metadata)
-        layer.commitChanges()
+    def update_metadata(self, layer, link_type, source=None):
+        source = source or layer.publicSource()
+        self.provenance(layer).add_source(layer.name(), source, link_type).apply(layer)
 
 metadata_manager = LayerMetadataManager()
 
-class LoadParcelsTask(QgsTask):
-    def __init__(self, description=None, ko_id=None, callback=None):
+
+class WfsTask(QgsTask):
+    """Cancelable task whose WFS downloads follow self.feedback.
+
+    cancel() cancels the feedback as well, which aborts the HTTP streams,
+    pagination and copying the task runs with it. Download progress drives
+    the task progress (unless feedback_progress is False because the task
+    reports its own) and the status text in self.loading_label, if any.
+    """
+
+    feedback_progress = True
+
+    def __init__(self, description=None):
         super().__init__(description, QgsTask.CanCancel)
+        self.feedback = WfsFeedback()
+        self.feedback.statusChanged.connect(self.show_status)
+
+    @pyqtSlot()
+    def show_status(self):
+        # queued to the main thread, the task may have finished meanwhile
+        if self.isCanceled() or self.status() in (QgsTask.Complete, QgsTask.Terminated):
+            return
+        fraction = self.feedback.fraction()
+        if self.feedback_progress and fraction is not None:
+            self.setProgress(100 * fraction)
+        loading_label = getattr(self, 'loading_label', None)
+        if loading_label is not None:
+            loading_label.setStyleSheet("color: black;")
+            loading_label.setText(self.feedback.status_text())
+            loading_label.setVisible(True)
+
+    def cancel(self):
+        self.feedback.cancel()
+        if getattr(self, 'exception', None) is None:
+            self.exception = tr('Prenos preklican')
+        super().cancel()
+
+class LoadParcelsTask(WfsTask):
+    """Parcel numbers of a KO as a ParcelNumberIndex, from the per-KO cache while it is fresh.
+
+    While a download is running, parcelsLoaded delivers the stale cached list
+    and then a growing index after every WFS page.
+    """
+
+    parcelsLoaded = pyqtSignal(object)
+
+    def __init__(self, description=None, ko_id=None, callback=None):
+        super().__init__(description)
         self.ko_id = ko_id
-        self.result_list = []
+        self.parcel_index = ParcelNumberIndex([])
         self.exception = None
         self.callback = callback
-        self.connect_to_wfs = connect_to_wfs
-        self.data = None
         self.tr = tr
 
     def run(self):
         try:
-            self.data = self.connect_to_wfs(return_type='json', typeName="SI.GURS.KN:OSNOVNI_PARCELE", propertyName="ST_PARCELE", cql_filter=f"KO_ID={self.ko_id}")
-            if 'error' in self.data:
-                self.exception = self.data['error']
-                return False
-            elif 'features' in self.data:
-                self.result_list = [feature['properties']['ST_PARCELE'] for feature in self.data.get('features', [])] 
+            cached = parcel_number_cache.load(self.ko_id)
+            if cached is not None and parcel_number_cache.is_fresh(cached[1]):
+                self.parcel_index = cached[0]
                 return True
-        
+            if cached is not None:
+                self.parcelsLoaded.emit(cached[0])
+            # numbers are cached per KO, skip the WFS response cache
+            features = iter_wfs_features("SI.GURS.KN:OSNOVNI_PARCELE", "ST_PARCELE", f"KO_ID={self.ko_id}", use_cache=False, feedback=self.feedback)
+            numbers = []
+            while True:
+                page = [feature['properties']['ST_PARCELE'] for feature in islice(features, WFS_PAGE_SIZE)]
+                if self.isCanceled():
+                    return False
+                numbers.extend(page)
+                if len(page) < WFS_PAGE_SIZE:
+                    break
+                if cached is None:
+                    self.parcelsLoaded.emit(ParcelNumberIndex(numbers))
+            self.parcel_index = ParcelNumberIndex(numbers)
+            if len(self.parcel_index) > 0:
+                parcel_number_cache.save(self.ko_id, self.parcel_index)
+            elif cached is not None:
+                self.parcel_index = cached[0]
+            return True
+
+        except WfsCanceledError:
+            return False
         except Exception as e:
             self.exception = e
+            cached = parcel_number_cache.load(self.ko_id)
+            if cached is not None:
+                # stale numbers are better than none
+                QgsMessageLog.logMessage(str(e), MESSAGE_CATEGORY, Qgis.Warning)
+                self.parcel_index = cached[0]
+                return True
             return False
       
     def finished(self, result):
-        if result and len(self.result_list) > 0:     
-            self.result_list.sort()
-            self.callback(self.result_list)
-        else:
-            self.result_list = []
-            self.callback(self.result_list)
+        if not result:
+            self.parcel_index = ParcelNumberIndex([])
+        self.callback(self.parcel_index)
 
     def cancel(self):
         QgsMessageLog.logMessage(self.tr("Uporabnik je preklical nalaganje parcele"), MESSAGE_CATEGORY, Qgis.Info)
         super().cancel()
 
-class LoadKoTask(QgsTask):
-    def __init__(self, description=None, callback=None):
-        super().__init__(description, QgsTask.CanCancel)
+KO_TYPE_NAME = "SI.GURS.KN:KATASTRSKE_OBCINE"
+
+
+def ko_directory_path():
+    """KO directory cache in the QGIS user profile"""
+    return os.path.join(plugin_profile_dir(), "ko.csv")
+
+
+def read_ko_csv(path):
+    ko_dict = {}
+    with open(path, mode='r', newline='', encoding='utf-8') as file:
+        reader = csv.DictReader(file)
+        for row in reader:
+            ko_dict[row['KO_ID']] = row['NAZIV']
+    return ko_dict
+
+
+def write_ko_csv(path, ko_dict):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, mode='w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['KO_ID', 'NAZIV'])  # Header
+        for ko_id, naziv in ko_dict.items():
+            writer.writerow([ko_id, naziv])
+    os.replace(tmp_path, path)
+
+
+def cached_ko_directory():
+    """KO directory from the user profile, seeded by the copy shipped with the plugin"""
+    for path in (ko_directory_path(), os.path.join(os.path.dirname(__file__), "ko.csv")):
+        if not os.path.exists(path):
+            continue
+        try:
+            return read_ko_csv(path)
+        except (OSError, KeyError, csv.Error) as e:
+            QgsMessageLog.logMessage(tr(f"Napaka pri branju {path}: {e}"), MESSAGE_CATEGORY, Qgis.Warning)
+    return {}
+
+
+def ko_directory_is_fresh():
+    path = ko_directory_path()
+    if not os.path.exists(path):
+        return False
+    return time.time() - os.path.getmtime(path) < setting_value('ko/ttl_hours') * 3600
+
+
+class LoadKoTask(WfsTask):
+    """Refresh the KO directory from WFS in the background.
+
+    callback receives the new directory only if it differs from current,
+    and None if nothing changed or the refresh failed.
+    """
+
+    def __init__(self, description=None, callback=None, current=None):
+        super().__init__(description)
         self.callback = callback
-        self.plugin_folder = os.path.dirname(__file__)
-        self.csv_ko_file = os.path.join(self.plugin_folder, "ko.csv")
+        self.current = current or {}
+        self.csv_ko_file = ko_directory_path()
+        self.ko_dict = None
+        self.changed = False
         self.exception = None
         self.tr = tr
 
     def run(self):
         try:
-            if os.path.exists(self.csv_ko_file):
-                self.ko_dict = self.load_from_csv()
-                self.update_ko_csv()
-                return True
+            self.ko_dict = self.load_from_wfs()
+            if not self.ko_dict or self.isCanceled():
+                return False
+            if self.ko_dict != self.current or not os.path.exists(self.csv_ko_file):
+                write_ko_csv(self.csv_ko_file, self.ko_dict)
+                self.changed = self.ko_dict != self.current
             else:
-                self.ko_dict = self.load_from_wfs()
-                if self.ko_dict:
-                    self.save_to_csv(self.ko_dict)
-                    return True
-                else:
-                    return False
+                # unchanged, only renew the TTL
+                os.utime(self.csv_ko_file)
+            return True
 
         except Exception as e:
             self.exception = e
@@ -185,43 +820,22 @@ class LoadKoTask(QgsTask):
 
     def finished(self, result):
         if result:
-            self.callback(self.ko_dict)
+            QgsMessageLog.logMessage(self.tr(f"Seznam K. O. osvežen, spremembe: {'da' if self.changed else 'ne'}"), MESSAGE_CATEGORY, Qgis.Info)
+            self.callback(self.ko_dict if self.changed else None)
         else:
-            self.callback({})
+            self.callback(None)
             QgsMessageLog.logMessage(f"Error: {self.exception if self.exception else self.tr('Neznana napaka')}", MESSAGE_CATEGORY, Qgis.Warning)
 
-
     def load_from_wfs(self):
-        data = connect_to_wfs(return_type='json', typeName="SI.GURS.KN:KATASTRSKE_OBCINE", propertyName="KO_ID,NAZIV")
-        if data:
-            ko_dict = {feature['properties']['KO_ID']: feature['properties']['NAZIV'] for feature in data.get('features', [])}
-            return ko_dict
-        
-    def load_from_csv(self):
-        ko_dict = {}
-        with open(self.csv_ko_file, mode='r', newline='', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                ko_dict[row['KO_ID']] = row['NAZIV']
-        return ko_dict
-    
-    def save_to_csv(self, ko_dict):
-        with open(self.csv_ko_file, mode='w', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow(['KO_ID', 'NAZIV'])  # Header
-            for ko_id, naziv in ko_dict.items():
-                writer.writerow([ko_id, naziv])
-
-    def update_ko_csv(self):
-        ko_dict = self.load_from_wfs()
-        if ko_dict:
-            self.save_to_csv(ko_dict)
-
-  
-
-class FindParcelTask(QgsTask):
-    def __init__(self, description=None, iface=None, loading_label=None, ko_id=None, parcela=None):
-        super().__init__(description, QgsTask.CanCancel)
+        # the KO directory is cached on its own, skip the WFS response cache
+        features = iter_wfs_features(KO_TYPE_NAME, "KO_ID,NAZIV", use_cache=False, feedback=self.feedback)
+        return {str(feature['properties']['KO_ID']): feature['properties']['NAZIV'] for feature in features}
+
+
+class FindParcelTask(WfsTask):
+    def __init__(self, description=None, iface=None, loading_label=None, ko_id=None, parcela=None, output_format='memory', output_folder=None):
+        super().__init__(description)
+        self.sink = ResultSink(f"K. O. {ko_id}, parcela {parcela}", output_format, output_folder)
         self.description = description
         self.iface = iface
         self.loading_label = loading_label
@@ -234,23 +848,40 @@ class FindParcelTask(QgsTask):
 
     def run(self):
         try:
-            self.layer = connect_to_wfs(return_type='layer', typeName="SI.GURS.KN:PARCELE", cql_filter=f"KO_ID={self.ko_id} AND ST_PARCELE='{self.parcela}'")
-            if self.layer.isValid():
-                self.geometry = next(self.layer.getFeatures()).geometry()
+            local_store = local_store_for_ko(self.ko_id)
+            if local_store is not None:
+                self.local_layer = local_store.find_parcel(self.ko_id, self.parcela)
+                if self.local_layer.featureCount() == 0:
+                    self.exception = self.tr('Ne najdem parcele.')
+                    return False
+                self.geometry = next(self.local_layer.getFeatures()).geometry()
+                self.local_layer.setName(f"K. O. {self.ko_id}, parcela {self.parcela}")
                 if self.description == 'Naloži':
-                    self.local_layer = layer_to_scratch_layer(self.layer)
-                    self.local_layer.setName(f"K. O. {self.ko_id}, parcela {self.parcela}") 
-        
+                    self.local_layer = write_layer_to_sink(self.local_layer, self.sink)
                 return True
-            else:
+
+            type_name = "SI.GURS.KN:PARCELE"
+            cql_filter = f"KO_ID={self.ko_id} AND ST_PARCELE='{self.parcela}'"
+            data = connect_to_wfs(return_type='json', typeName=type_name, cql_filter=cql_filter, feedback=self.feedback)
+            if 'error' in data:
+                self.exception = data['error']
+                return False
+            if not data['features']:
                 self.exception = self.tr('Ne najdem parcele.')
                 return False
+            self.local_layer = features_to_scratch_layer(data['features'], type_name, wfs_request_url(type_name, cql_filter=cql_filter))
+            self.geometry = next(self.local_layer.getFeatures()).geometry()
+            self.local_layer.setName(f"K. O. {self.ko_id}, parcela {self.parcela}")
+            if self.description == 'Naloži':
+                self.local_layer = write_layer_to_sink(self.local_layer, self.sink)
+            return True
         except Exception as e:
             self.exception = e
             return False
         
     def finished(self, result):
         if result:
+            self.loading_label.setVisible(False)
             self.flash_it(self.iface, self.geometry)
             if self.description == 'Naloži':
                 QgsProject.instance().addMapLayer(self.local_layer)  
@@ -296,49 +927,60 @@ class LoadQlrTask(QgsTask):
             QgsMessageLog.logMessage(f"Error: {self.exception if self.exception else self.tr('Neznana napaka')}", MESSAGE_CATEGORY, Qgis.Warning)
         
 
-class FetchByAreaTask(QgsTask):
-    def __init__(self, description=None, loading_label=None, layer=None, buffer=None):
-        super().__init__(description, QgsTask.CanCancel)
+class FetchByAreaTask(WfsTask):
+    def __init__(self, description=None, loading_label=None, layer=None, buffer=None, selected_only=False, output_format='memory', output_folder=None):
+        super().__init__(description)
         self.description = description
         self.loading_label = loading_label
-        self.selection_layer = layer
+        self.geometry_source = SelectionGeometrySource(layer, selected_only)
         self.buffer = buffer
+        self.sink = ResultSink(self.tr("Izbor parcel"), output_format, output_folder)
         self.exception = None
         self.tr = tr
 
     def run(self):
         try:   
-            fixed_layer = processing.run('native:fixgeometries', {
-                    'INPUT': self.selection_layer,
-                    'OUTPUT': 'memory:'
-                })['OUTPUT']
-
-            dissolved_layer = processing.run('native:dissolve',  {
-                    'INPUT': fixed_layer,
-                    'FIELD': [],
-                    'OUTPUT': 'memory:'
-                })['OUTPUT']
-
-            if self.buffer != 0:
-                buffer_layer = processing.run('native:buffer', {
-                    'INPUT': dissolved_layer,
-                    'DISTANCE': self.buffer,
-                    'OUTPUT': 'memory:'
-                })['OUTPUT']
-                self.selection_layer = buffer_layer
-            else:
-                self.selection_layer = dissolved_layer
+            type_name = "SI.GURS.KN:OSNOVNI_PARCELE"
+            selection_geometry = prepare_selection_geometry(self.geometry_source, WFS_CRS, self.buffer, is_canceled=self.isCanceled)
+            if selection_geometry is None:
+                return False
+            if selection_geometry.isEmpty():
+                self.exception = self.tr('Sloj za presek nima geometrij.')
+                return False
 
-            layer_bbox = self.selection_layer.extent()
-            bbox = f"{layer_bbox.xMinimum()},{layer_bbox.yMinimum()},{layer_bbox.xMaximum()},{layer_bbox.yMaximum()}"
-            self.wfs_layer = connect_to_wfs(return_type='layer', typeName="SI.GURS.KN:OSNOVNI_PARCELE", bbox=bbox)
-    
-            self.selection = processing.run("native:extractbylocation", 
-                                    {'INPUT': self.wfs_layer,
-                                    'PREDICATE': [0],
-                                    'INTERSECT':self.selection_layer,
-                                    'OUTPUT':'TEMPORARY_OUTPUT'})['OUTPUT']
-            self.local_layer = layer_to_scratch_layer(self.selection)
+            engine = IntersectionEngine(selection_geometry)
+            local_store = local_store_for_area(selection_geometry)
+            if local_store is not None:
+                source_layer = local_store.layer()
+                request = QgsFeatureRequest().setFilterRect(engine.bbox)
+                if hasattr(request, 'setFeedback'):
+                    # QGIS 3.20+, the provider stops fetching once canceled
+                    request.setFeedback(self.feedback)
+                self.sink.add_features(source_layer.fields(), source_layer.crs(), engine.filter_features(source_layer.getFeatures(request)),
+                                       feedback=self.feedback)
+                if self.isCanceled():
+                    return False
+                # Provenance of locally stored parcels is the original fetch
+                self.local_layer = self.sink.finish(metadata_layer=source_layer)
+            else:
+                crs = QgsCoordinateReferenceSystem(WFS_CRS)
+                # Same selection and tile size resume the tiles of an interrupted fetch
+                journal = download_journals.open('tiles', type_name, selection_geometry.asWkt(3), setting_value('area/tile_size_m'),
+                                                 description=self.tr('Izbor parcel'))
+                features = iter_area_features(type_name, selection_geometry, feedback=self.feedback, journal=journal)
+                fields = None
+                for batch in iter_page_batches(features):
+                    if self.isCanceled():
+                        return False
+                    if fields is None:
+                        fields = geojson_fields(batch)
+                    self.sink.add_features(fields, crs, engine.filter_features(geojson_to_features(batch, fields)))
+                # parcels of the selection extent, further clipped to the selection geometry
+                self.local_layer = self.sink.finish(source=wfs_request_url(type_name, bbox=wfs_bbox(selection_geometry.boundingBox())))
+                journal.finish()
+            if self.local_layer is None:
+                self.exception = self.tr('Na območju ni parcel.')
+                return False
             return True
      
         except Exception as e:
@@ -359,24 +1001,389 @@ class FetchByAreaTask(QgsTask):
 
             
 
-def layer_to_scratch_layer(wfs_layer, geom_str='Polygon'):
-    temp_layer = QgsVectorLayer(f'{geom_str}?crs={wfs_layer.crs().authid()}', wfs_layer.name(), "memory")    
-    temp_layer_data_provider = temp_layer.dataProvider()
+class MirrorKoTask(WfsTask):
+    """Copy whole KOs (parcels and KO boundary) from the WFS into the local GeoPackage mirror"""
+
+    feedback_progress = False
+
+    def __init__(self, description=None, ko_ids=None, loading_label=None):
+        super().__init__(description)
+        self.description = description
+        self.ko_ids = [str(ko_id) for ko_id in ko_ids or []]
+        self.loading_label = loading_label
+        self.parcel_count = 0
+        self.exception = None
+        self.tr = tr
+
+    def run(self):
+        parcel_pages = None
+        try:
+            for i, ko_id in enumerate(self.ko_ids):
+                if self.isCanceled():
+                    return False
+                cql_filter = f"KO_ID={int(ko_id)}"
+                journal = download_journals.open('pages', "SI.GURS.KN:OSNOVNI_PARCELE", cql_filter, WFS_PAGE_SIZE, description=f"K. O. {ko_id}")
+                parcel_pages = iter_wfs_pages(typeName="SI.GURS.KN:OSNOVNI_PARCELE", cql_filter=cql_filter, feedback=self.feedback, journal=journal)
+                # read the boundary completely, a paused stream would hold a connection slot
+                boundary_pages = list(iter_wfs_pages(typeName="SI.GURS.KN:KATASTRSKE_OBCINE", cql_filter=cql_filter, feedback=self.feedback))
+
+                first_parcels = next(parcel_pages, [])
+                first_boundary = boundary_pages.pop(0) if boundary_pages else []
+                if not first_parcels or not first_boundary:
+                    raise WfsError(self.tr(f'Ne najdem parcel za K. O. {ko_id}'))
+                parcel_fields = geojson_fields(first_parcels)
+                boundary_fields = geojson_fields(first_boundary)
+
+                self.parcel_count += parcel_mirror.replace_ko(
+                    ko_id,
+                    (parcel_fields, boundary_fields),
+                    WFS_CRS,
+                    (geojson_to_features(page, parcel_fields) for page in chain([first_parcels], parcel_pages)),
+                    (geojson_to_features(page, boundary_fields) for page in chain([first_boundary], boundary_pages)),
+                    wfs_request_url("SI.GURS.KN:OSNOVNI_PARCELE", cql_filter=cql_filter)
+                )
+                journal.finish()
+                self.setProgress(100 * (i + 1) / len(self.ko_ids))
+            return True
+        except Exception as e:
+            self.exception = e
+            return False
+        finally:
+            # a page stream left suspended holds its response and rate limiter slot
+            if parcel_pages is not None:
+                parcel_pages.close()
+
+    def finished(self, result):
+        if result:
+            QgsMessageLog.logMessage(self.tr(f"Lokalno shranjene K. O.: {', '.join(self.ko_ids)} ({self.parcel_count} parcel)"), MESSAGE_CATEGORY, Qgis.Info)
+            if self.loading_label:
+                self.loading_label.setStyleSheet("color: green;")
+                self.loading_label.setText(self.tr(f"Lokalno shranjenih parcel: {self.parcel_count}"))
+                self.loading_label.setVisible(True)
+        else:
+            QgsMessageLog.logMessage(f"Error: {self.exception if self.exception else self.tr('Neznana napaka')}", MESSAGE_CATEGORY, Qgis.Warning)
+            if self.loading_label:
+                self.loading_label.setStyleSheet("color: red;")
+                self.loading_label.setText(self.tr(f"Error: {self.exception if self.exception else self.tr('Neznana napaka')}"))
+                self.loading_label.setVisible(True)
+
+
+class ImportSnapshotTask(QgsTask):
+    """Import a GURS bulk parcel file into the national local parcel store"""
+
+    def __init__(self, description=None, source_path=None, loading_label=None):
+        super().__init__(description, QgsTask.CanCancel)
+        self.description = description
+        self.source_path = source_path
+        self.loading_label = loading_label
+        self.count = None
+        self.exception = None
+        self.tr = tr
+
+    def run(self):
+        try:
+            self.count = parcel_snapshot.import_snapshot(self.source_path, set_progress=self.setProgress, is_canceled=self.isCanceled)
+            return self.count is not None
+        except Exception as e:
+            self.exception = e
+            return False
+
+    def finished(self, result):
+        if result:
+            self.loading_label.setStyleSheet("color: green;")
+            self.loading_label.setText(self.tr(f"Uvoženih parcel: {self.count}"))
+        else:
+            QgsMessageLog.logMessage(f"Error: {self.exception if self.exception else self.tr('Neznana napaka')}", MESSAGE_CATEGORY, Qgis.Warning)
+            self.loading_label.setStyleSheet("color: red;")
+            self.loading_label.setText(self.tr(f"Error: {self.exception if self.exception else self.tr('Neznana napaka')}"))
+        self.loading_label.setVisible(True)
+
 
-    # Copy fields from WFS layer to temporary layer
-    temp_layer_data_provider.addAttributes(wfs_layer.fields())
+class BatchParcelTask(WfsTask):
+    """Load many (KO_ID, ST_PARCELE) pairs into one layer.
+
+    Pairs are grouped by KO and requested in chunks of BATCH_CQL_CHUNK parcels
+    with a ST_PARCELE IN (...) filter, locally stored KOs are read from the
+    local parcel store. Pairs that were not found are collected in self.unmatched.
+    """
+
+    BATCH_CQL_CHUNK = 100
+
+    feedback_progress = False
+
+    def __init__(self, description=None, pairs=None, loading_label=None):
+        super().__init__(description)
+        self.description = description
+        self.pairs = pairs or []
+        self.loading_label = loading_label
+        self.local_layer = None
+        self.unmatched = []
+        self.exception = None
+        self.tr = tr
+
+    def run(self):
+        try:
+            groups = {}
+            for ko_id, parcela in self.pairs:
+                groups.setdefault(ko_id, set()).add(parcela)
+
+            found = set()
+            done = 0
+            for ko_id, parcels in groups.items():
+                local_store = local_store_for_ko(ko_id)
+                parcels = sorted(parcels)
+                for i in range(0, len(parcels), self.BATCH_CQL_CHUNK):
+                    if self.isCanceled():
+                        return False
+                    chunk = parcels[i:i + self.BATCH_CQL_CHUNK]
+                    in_list = ','.join("'{}'".format(parcela.replace("'", "''")) for parcela in chunk)
+                    if local_store is not None:
+                        source_layer = local_store.layer()
+                        request = QgsFeatureRequest().setFilterExpression(f'"KO_ID" = {int(ko_id)} AND "ST_PARCELE" IN ({in_list})')
+                        fields = source_layer.fields()
+                        features = list(source_layer.getFeatures(request))
+                    else:
+                        geojson = list(iter_wfs_features(typeName="SI.GURS.KN:OSNOVNI_PARCELE", cql_filter=f"KO_ID={int(ko_id)} AND ST_PARCELE IN ({in_list})",
+                                                            feedback=self.feedback))
+                        fields = geojson_fields(geojson) if geojson else None
+                        features = geojson_to_features(geojson, fields) if geojson else []
+
+                    if features and self.local_layer is None:
+                        self.local_layer = QgsVectorLayer(f'MultiPolygon?crs={WFS_CRS}', self.tr("Seznam parcel"), "memory")
+                        self.local_layer.dataProvider().addAttributes(fields)
+                        self.local_layer.updateFields()
+                    if features:
+                        self.local_layer.dataProvider().addFeatures(remap_features(features, self.local_layer.fields()))
+                    found.update((ko_id, str(feature['ST_PARCELE'])) for feature in features)
+                    done += len(chunk)
+                    self.setProgress(100 * done / len(self.pairs))
+
+            self.unmatched = [pair for pair in self.pairs if pair not in found]
+            if self.local_layer is None:
+                self.exception = self.tr('Ne najdem nobene parcele s seznama.')
+                return False
+            index_scratch_layer(self.local_layer)
+            self.local_layer.updateExtents()
+            metadata_manager.update_metadata(self.local_layer, 'OGC:WFS', source=wfs_request_url("SI.GURS.KN:OSNOVNI_PARCELE"))
+            return True
+        except Exception as e:
+            self.exception = e
+            return False
+
+    def finished(self, result):
+        if result:
+            QgsProject.instance().addMapLayer(self.local_layer)
+            if self.unmatched:
+                QgsProject.instance().addMapLayer(unmatched_pairs_layer(self.unmatched))
+                QgsMessageLog.logMessage(self.tr(f"Ne najdem {len(self.unmatched)} parcel s seznama"), MESSAGE_CATEGORY, Qgis.Warning)
+                self.loading_label.setStyleSheet("color: orange;")
+                self.loading_label.setText(self.tr(f"Naloženih {self.local_layer.featureCount()} parcel, ne najdem {len(self.unmatched)}"))
+                self.loading_label.setVisible(True)
+            else:
+                self.loading_label.setVisible(False)
+        else:
+            QgsMessageLog.logMessage(f"Error: {self.exception if self.exception else self.tr('Neznana napaka')}", MESSAGE_CATEGORY, Qgis.Warning)
+            self.loading_label.setStyleSheet("color: red;")
+            self.loading_label.setText(self.tr(f"Error: {self.exception if self.exception else self.tr('Neznana napaka')}"))
+            self.loading_label.setVisible(True)
+
+
+def normalize_parcel_pair(ko_id, parcela):
+    """Return (KO_ID, ST_PARCELE) as compared against the WFS, None for rows that are not a pair"""
+    ko_id = str(ko_id).split(" - ")[0].strip()
+    parcela = str(parcela).strip()
+    if not ko_id.isdigit() or not parcela or parcela.upper() == 'NULL':
+        return None
+    return str(int(ko_id)), parcela
+
+
+def read_parcel_pairs_csv(csv_file):
+    """Read (KO_ID, ST_PARCELE) pairs from a CSV file with KO_ID and ST_PARCELE columns,
+    or from its first two columns when there are no such headers"""
+    with open(csv_file, mode='r', newline='', encoding='utf-8-sig') as file:
+        sample = file.read(4096)
+        file.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        rows = list(csv.reader(file, dialect))
+    if not rows:
+        return []
+    header = [column.strip().upper() for column in rows[0]]
+    if 'KO_ID' in header and 'ST_PARCELE' in header:
+        ko_column, parcel_column = header.index('KO_ID'), header.index('ST_PARCELE')
+        rows = rows[1:]
+    else:
+        ko_column, parcel_column = 0, 1
+    pairs = (normalize_parcel_pair(row[ko_column], row[parcel_column]) for row in rows if len(row) > max(ko_column, parcel_column))
+    return [pair for pair in pairs if pair]
+
+
+def read_parcel_pairs_layer(layer, selected_only=False):
+    """Read (KO_ID, ST_PARCELE) pairs from the attribute table of a layer"""
+    missing = [name for name in ('KO_ID', 'ST_PARCELE') if layer.fields().lookupField(name) < 0]
+    if missing:
+        raise ValueError(tr(f"V sloju manjkajo polja: {', '.join(missing)}"))
+    request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry).setSubsetOfAttributes(['KO_ID', 'ST_PARCELE'], layer.fields())
+    features = layer.getSelectedFeatures(request) if selected_only else layer.getFeatures(request)
+    pairs = (normalize_parcel_pair(feature['KO_ID'], feature['ST_PARCELE']) for feature in features)
+    return [pair for pair in pairs if pair]
+
+
+def remap_features(features, fields):
+    """Copy features to the given fields, matching attributes by name"""
+    remapped = []
+    for feature in features:
+        new_feature = QgsFeature(fields)
+        new_feature.setGeometry(feature.geometry())
+        for index, field in enumerate(feature.fields()):
+            target_index = fields.lookupField(field.name())
+            if target_index >= 0:
+                new_feature.setAttribute(target_index, feature.attribute(index))
+        remapped.append(new_feature)
+    return remapped
+
+
+def unmatched_pairs_layer(pairs):
+    """Table layer listing (KO_ID, ST_PARCELE) pairs that were not found"""
+    layer = QgsVectorLayer("None?field=KO_ID:integer&field=ST_PARCELE:string", tr("Ne najdene parcele"), "memory")
+    features = []
+    for ko_id, parcela in pairs:
+        feature = QgsFeature(layer.fields())
+        feature.setAttributes([int(ko_id), parcela])
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+def geojson_fields(features):
+    """Fields of a list of GeoJSON features"""
+    return QgsJsonUtils.stringToFields(json.dumps({'type': 'FeatureCollection', 'features': features[:1]}))
+
+
+def geojson_to_features(features, fields):
+    """Convert GeoJSON features to QgsFeatures with the given fields"""
+    return QgsJsonUtils.stringToFeatureList(json.dumps({'type': 'FeatureCollection', 'features': features}), fields)
+
+
+class ResultSink:
+    """Destination of a task result: a memory layer or a GeoPackage/FlatGeobuf file.
+
+    Features are added in batches of SCRATCH_BATCH_SIZE as they stream in.
+    File outputs are written through QgsVectorFileWriter with a spatial index,
+    so results larger than RAM can be stored and reopened with the project.
+    """
+
+    EXTENSIONS = {'GPKG': 'gpkg', 'FlatGeobuf': 'fgb'}
+
+    def __init__(self, name, output_format='memory', output_folder=None):
+        self.name = name
+        self.output_format = output_format if output_format in self.EXTENSIONS else 'memory'
+        self.output_folder = output_folder
+        self.path = None
+        self.layer = None
+        self.writer = None
+        self.fields = None
+        self.count = 0
+
+    def _create(self, fields, crs):
+        self.fields = fields
+        if self.output_format == 'memory':
+            self.layer = QgsVectorLayer(f'MultiPolygon?crs={crs.authid()}', self.name, "memory")
+            self.layer.dataProvider().addAttributes(fields)
+            self.layer.updateFields()
+            self.fields = self.layer.fields()
+            return
+        file_name = re.sub(r'[^\w.-]+', '_', self.name).strip('_')
+        self.path = os.path.join(self.output_folder, f"{file_name}_{datetime.now():%Y%m%d_%H%M%S}.{self.EXTENSIONS[self.output_format]}")
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = self.output_format
+        options.layerName = file_name
+        options.layerOptions = ['SPATIAL_INDEX=YES']
+        self.writer = QgsVectorFileWriter.create(self.path, fields, QgsWkbTypes.MultiPolygon, crs, QgsCoordinateTransformContext(), options)
+        if self.writer.hasError() != QgsVectorFileWriter.NoError:
+            raise IOError(self.writer.errorMessage())
+
+    def add_features(self, fields, crs, features, feedback=None):
+        """Add an iterable of features with the given fields and CRS, stops once feedback is canceled"""
+        batch = []
+        for feature in features:
+            batch.append(feature)
+            if len(batch) >= SCRATCH_BATCH_SIZE:
+                if feedback is not None and feedback.isCanceled():
+                    return
+                self._add_batch(fields, crs, batch)
+                batch = []
+        if batch and (feedback is None or not feedback.isCanceled()):
+            self._add_batch(fields, crs, batch)
+
+    def _add_batch(self, fields, crs, batch):
+        if self.fields is None:
+            self._create(fields, crs)
+        if self.writer is not None:
+            if not self.writer.addFeatures(batch):
+                raise IOError(self.writer.errorMessage())
+        else:
+            self.layer.dataProvider().addFeatures(batch)
+        self.count += len(batch)
+
+    def finish(self, source=None, metadata_layer=None):
+        """Close the output and return its layer, None if nothing was added.
+
+        The metadata of metadata_layer is carried over and source is recorded
+        as the data source, file outputs store it next to the data.
+        """
+        if self.fields is None:
+            return None
+        if self.writer is not None:
+            del self.writer
+            self.writer = None
+            self.layer = QgsVectorLayer(self.path, self.name, "ogr")
+        else:
+            index_scratch_layer(self.layer)
+            self.layer.updateExtents()
+        provenance = metadata_manager.provenance(metadata_layer)
+        if source:
+            provenance.add_source(self.name, source)
+        provenance.apply(self.layer, save=self.path is not None)
+        return self.layer
+
+
+def write_layer_to_sink(layer, sink):
+    """Store a finished layer in sink, a memory sink returns the layer unchanged"""
+    if sink.output_format == 'memory':
+        return layer
+    sink.add_features(layer.fields(), layer.crs(), layer.getFeatures())
+    return sink.finish(metadata_layer=layer)
+
+
+def index_scratch_layer(layer):
+    """Spatial index and KO_ID/ST_PARCELE attribute indexes on a memory layer"""
+    provider = layer.dataProvider()
+    provider.createSpatialIndex()
+    for name in ('KO_ID', 'ST_PARCELE'):
+        field_index = layer.fields().lookupField(name)
+        if field_index >= 0:
+            provider.createAttributeIndex(field_index)
+
+
+def features_to_scratch_layer(features, name, source):
+    """Build a memory layer from GeoJSON features returned by connect_to_wfs"""
+    fields = geojson_fields(features)
+    geom_str = features[0]['geometry']['type'] if features and features[0].get('geometry') else 'Polygon'
+    temp_layer = QgsVectorLayer(f'{geom_str}?crs={WFS_CRS}', name, "memory")
+    temp_layer_data_provider = temp_layer.dataProvider()
+    temp_layer_data_provider.addAttributes(fields)
     temp_layer.updateFields()
-    # Copy all features from WFS layer to temporary layer
-    for feature in wfs_layer.getFeatures():
-        temp_layer_data_provider.addFeature(feature)
-    
-    metadata_manager.update_metadata(wfs_layer, 'OGC:WFS')
-    metadata_manager.transfer_metadata(wfs_layer, temp_layer)
+    temp_layer_data_provider.addFeatures(geojson_to_features(features, fields))
+    index_scratch_layer(temp_layer)
+
+    metadata_manager.update_metadata(temp_layer, 'OGC:WFS', source=source)
     temp_layer.updateExtents()
     return temp_layer
 
 
-
 def zoom_to_and_flash_geometry_from_layer(iface, geometry):
     if geometry:
         canvas = iface.mapCanvas()
@@ -384,7 +1391,7 @@ def zoom_to_and_flash_geometry_from_layer(iface, geometry):
         canvas.refresh()
         canvas.flashGeometries(
             [geometry], 
-            QgsCoordinateReferenceSystem('EPSG:3794'),
+            QgsCoordinateReferenceSystem(WFS_CRS),
             QColor(255, 66, 0),  # Flash color (orange)
             QColor(0, 66, 0),    # Secondary color (green)
             flashes=3,  
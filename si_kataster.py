@@ -209,6 +209,10 @@ class SiKataster:
             callback=self.run,
             parent=self.iface.mainWindow())
 
+        # QGIS' own requests to GURS (QLR WFS layers) count against the plugin's rate limit
+        from .si_kataster_http import qgis_network_throttle
+        qgis_network_throttle.install()
+
     #--------------------------------------------------------------------------
 
     def onClosePlugin(self):
@@ -231,6 +235,15 @@ class SiKataster:
         # remove the toolbar
         del self.toolbar
         
+        # Stop probing GURS and release pooled connections
+        from .si_kataster_health import health_monitor
+        from .si_kataster_http import GursHttpClient, qgis_network_throttle
+        from .si_kataster_scheduler import task_scheduler
+        health_monitor.stop()
+        task_scheduler.cancel_all()
+        qgis_network_throttle.remove()
+        GursHttpClient.close_shared_session()
+
         # Clean up web session
         try:
             from .si_kataster_2web import EsodstvoWebClient
@@ -0,0 +1,182 @@
+"""
+On-disk cache of decoded WFS GetFeature results.
+Entries live in the QGIS user profile, one JSON lines file per request plus a small meta file.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from qgis.core import QgsMessageLog, Qgis
+
+from .si_kataster_settings import setting_value, plugin_profile_dir
+
+
+MESSAGE_CATEGORY = 'SiKataster'
+
+
+class WfsCacheWriter:
+    """Streams features of one response into a temporary file, published on commit"""
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.tmp_path = os.path.join(cache.cache_dir(), f"{key}.{uuid.uuid4().hex}.tmp")
+        self.file = open(self.tmp_path, 'w', encoding='utf-8')
+        self.feature_count = 0
+
+    def write(self, features):
+        for feature in features:
+            self.file.write(json.dumps(feature, ensure_ascii=False))
+            self.file.write('\n')
+        self.feature_count += len(features)
+
+    def discard(self):
+        if not self.file.closed:
+            self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def commit(self, etag=None, last_modified=None):
+        self.file.close()
+        meta = {
+            'created': time.time(),
+            'etag': etag,
+            'last_modified': last_modified,
+            'feature_count': self.feature_count,
+        }
+        with self.cache.lock:
+            os.replace(self.tmp_path, self.cache.data_path(self.key))
+            with open(self.cache.meta_path(self.key), 'w', encoding='utf-8') as file:
+                json.dump(meta, file)
+        self.cache.evict()
+
+
+class WfsCache:
+    """LRU cache of WFS results keyed by typeName, propertyName, CQL_FILTER and BBOX.
+
+    Freshness is controlled by cache/ttl_hours, total size by cache/max_mb.
+    The modification time of the data file is the last access time used for eviction.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+
+    def enabled(self):
+        return setting_value('cache/enabled')
+
+    def cache_dir(self):
+        return plugin_profile_dir('cache', 'wfs')
+
+    def key(self, typeName=None, propertyName=None, cql_filter=None, bbox=None):
+        raw = json.dumps([typeName, propertyName, cql_filter, bbox])
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def data_path(self, key):
+        return os.path.join(self.cache_dir(), f"{key}.jsonl")
+
+    def meta_path(self, key):
+        return os.path.join(self.cache_dir(), f"{key}.meta.json")
+
+    def lookup(self, key):
+        """Return the meta dict of a cached entry or None"""
+        with self.lock:
+            if not os.path.exists(self.data_path(key)):
+                return None
+            try:
+                with open(self.meta_path(key), encoding='utf-8') as file:
+                    return json.load(file)
+            except (OSError, ValueError):
+                return None
+
+    def open(self, key):
+        """Return (meta, open data file) of a cached entry, None on a miss.
+
+        The entry is opened under the lock, an open file stays readable when
+        another task evicts the entry meanwhile.
+        """
+        with self.lock:
+            meta = self.lookup(key)
+            if meta is None:
+                return None
+            path = self.data_path(key)
+            try:
+                os.utime(path)
+                return meta, open(path, encoding='utf-8')
+            except OSError:
+                return None
+
+    def is_fresh(self, meta):
+        return time.time() - meta.get('created', 0) < setting_value('cache/ttl_hours') * 3600
+
+    def validator_headers(self, meta):
+        """Conditional request headers for revalidating an expired entry"""
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def renew(self, key, meta):
+        """Mark an entry as fresh again after the server answered 304 Not Modified"""
+        meta['created'] = time.time()
+        with self.lock:
+            if not os.path.exists(self.data_path(key)):
+                return
+            with open(self.meta_path(key), 'w', encoding='utf-8') as file:
+                json.dump(meta, file)
+
+    def read(self, file):
+        """Yield the features of an entry opened with open() one by one"""
+        with file:
+            for line in file:
+                yield json.loads(line)
+
+    def writer(self, key):
+        return WfsCacheWriter(self, key)
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits into cache/max_mb"""
+        max_bytes = setting_value('cache/max_mb') * 1024 * 1024
+        with self.lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.cache_dir()):
+                if not name.endswith('.jsonl'):
+                    continue
+                path = os.path.join(self.cache_dir(), name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, name[:-len('.jsonl')]))
+                total += stat.st_size
+            entries.sort()
+            while entries and total > max_bytes:
+                _, size, key = entries.pop(0)
+                self.remove(key)
+                total -= size
+
+    def remove(self, key):
+        with self.lock:
+            for path in (self.data_path(key), self.meta_path(key)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    # already gone, or still open for reading on Windows
+                    pass
+
+    def clear(self):
+        """Delete every cached response"""
+        with self.lock:
+            removed = 0
+            for name in os.listdir(self.cache_dir()):
+                if name.endswith('.tmp'):
+                    continue  # still being written by a running task
+                os.remove(os.path.join(self.cache_dir(), name))
+                removed += 1
+        QgsMessageLog.logMessage(f"Predpomnilnik WFS počiščen ({removed} datotek)", MESSAGE_CATEGORY, Qgis.Info)
+
+
+wfs_cache = WfsCache()
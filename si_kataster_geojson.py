@@ -0,0 +1,104 @@
+"""
+Incremental decoder for GeoJSON FeatureCollections.
+Features are decoded one at a time while the response body is still arriving.
+"""
+
+import codecs
+import json
+
+
+WHITESPACE = ' \t\n\r'
+
+
+class GeoJsonStreamError(ValueError):
+    pass
+
+
+class GeoJsonFeatureStream:
+    """Iterate over the features of a FeatureCollection read from byte chunks.
+
+    Top-level members other than "features" (numberMatched, totalFeatures, crs...)
+    are collected into self.members as they are passed, members that follow the
+    feature array are available once iteration has finished.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.members = {}
+
+    def _read_more(self):
+        """Append the next chunk to the buffer, False when the body is exhausted"""
+        if self.eof:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.eof = True
+            self.buffer += self.text_decoder.decode(b'', final=True)
+            return False
+        if self.pos > 65536:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        self.buffer += self.text_decoder.decode(chunk)
+        return True
+
+    def _next_char(self):
+        """Skip whitespace and return the next significant character without consuming it"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read_more():
+                raise GeoJsonStreamError('Unexpected end of GeoJSON document')
+
+    def _expect(self, chars):
+        char = self._next_char()
+        if char not in chars:
+            raise GeoJsonStreamError(f'Unexpected {char!r} at offset {self.pos} in GeoJSON document')
+        self.pos += 1
+        return char
+
+    def _decode_value(self):
+        """Decode one complete JSON value, reading more data until it is complete"""
+        self._next_char()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._read_more():
+                    continue
+                raise
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and not self.eof and self._read_more():
+                continue
+            self.pos = end
+            return value
+
+    def __iter__(self):
+        self._expect('{')
+        if self._next_char() == '}':
+            return
+        while True:
+            key = self._decode_value()
+            self._expect(':')
+            if key == 'features':
+                yield from self._iter_features()
+            else:
+                self.members[key] = self._decode_value()
+            if self._expect(',}') == '}':
+                return
+
+    def _iter_features(self):
+        self._expect('[')
+        if self._next_char() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self._decode_value()
+            if self._expect(',]') == ']':
+                return
@@ -0,0 +1,97 @@
+"""
+Geometry stages of the area selection pipeline.
+Selection geometries are prepared directly with QgsGeometry instead of chained processing algorithms.
+"""
+
+from qgis.core import (QgsCoordinateReferenceSystem, QgsFeatureRequest, QgsGeometry,
+                       QgsVectorLayerFeatureSource)
+
+
+UNION_BATCH_SIZE = 1000
+BUFFER_SEGMENTS = 5
+
+
+class SelectionGeometrySource:
+    """Snapshot of a selection layer that can be read from a background task.
+
+    Must be created on the main thread, the selected feature ids are captured
+    at that moment when selected_only is set.
+    """
+
+    def __init__(self, layer, selected_only=False):
+        self.source = QgsVectorLayerFeatureSource(layer)
+        self.crs = layer.crs()
+        self.transform_context = layer.transformContext()
+        self.selected_ids = layer.selectedFeatureIds() if selected_only else None
+
+    def geometries(self, dest_crs):
+        """Yield valid geometries of the source features, transformed to dest_crs"""
+        request = QgsFeatureRequest().setNoAttributes()
+        if self.selected_ids is not None:
+            request.setFilterFids(self.selected_ids)
+        if self.crs != QgsCoordinateReferenceSystem(dest_crs):
+            request.setDestinationCrs(QgsCoordinateReferenceSystem(dest_crs), self.transform_context)
+        for feature in self.source.getFeatures(request):
+            geometry = feature.geometry()
+            if geometry.isNull() or geometry.isEmpty():
+                continue
+            if not geometry.isGeosValid():
+                geometry = geometry.makeValid()
+            yield geometry
+
+
+def prepare_selection_geometry(source, dest_crs, buffer_distance=0, is_canceled=None):
+    """Fix, dissolve and buffer the selection into one geometry in dest_crs.
+
+    Geometries are unioned in batches of UNION_BATCH_SIZE as they stream from
+    the source, so only one batch and the running union are held in memory.
+    Returns an empty geometry if the source has no usable geometries and None
+    if cancelled.
+    """
+    union = None
+    batch = []
+    for geometry in source.geometries(dest_crs):
+        batch.append(geometry)
+        if len(batch) < UNION_BATCH_SIZE:
+            continue
+        if is_canceled and is_canceled():
+            return None
+        if union is not None:
+            batch.append(union)
+        union = QgsGeometry.unaryUnion(batch)
+        batch = []
+    if union is not None:
+        batch.append(union)
+    if not batch:
+        return QgsGeometry()
+    union = QgsGeometry.unaryUnion(batch)
+
+    if buffer_distance:
+        union = union.buffer(buffer_distance, BUFFER_SEGMENTS)
+    return union
+
+
+class IntersectionEngine:
+    """Tests candidate geometries against a selection prepared once.
+
+    The selection is handed to a GEOS prepared geometry, which indexes its
+    parts and segments internally. A bounding box test runs first, so most
+    non-matching candidates never reach GEOS.
+    """
+
+    def __init__(self, geometry):
+        self.geometry = geometry
+        self.bbox = geometry.boundingBox()
+        self.engine = QgsGeometry.createGeometryEngine(geometry.constGet())
+        self.engine.prepareGeometry()
+
+    def intersects(self, geometry):
+        if geometry.isNull() or not self.bbox.intersects(geometry.boundingBox()):
+            return False
+        return self.engine.intersects(geometry.constGet())
+
+    def filter_features(self, features):
+        """Yield the features whose geometry intersects the selection"""
+        for feature in features:
+            if self.intersects(feature.geometry()):
+                yield feature
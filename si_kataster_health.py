@@ -0,0 +1,62 @@
+"""
+Background health monitor for the GURS WFS.
+Probes GetCapabilities on a timer outside the GUI thread and keeps the last known state.
+"""
+
+import threading
+
+from qgis.PyQt.QtCore import QObject, QTimer, pyqtSignal
+
+from .functions_container import is_wfs_accessible
+from .si_kataster_http import GursHttpClient
+from .si_kataster_settings import setting_value
+
+
+class WfsHealthMonitor(QObject):
+    """Periodic availability probe feeding the circuit breaker of GursHttpClient"""
+
+    availabilityChanged = pyqtSignal(bool)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.available = None  # unknown until the first probe finishes
+        self._probe_running = False
+        self._lock = threading.Lock()
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.probe)
+
+    def start(self):
+        """Probe now and then every health/interval_s seconds"""
+        self.timer.start(int(setting_value('health/interval_s') * 1000))
+        self.probe()
+
+    def stop(self):
+        self.timer.stop()
+
+    def is_available(self):
+        """Last known state, never blocks. Optimistic until the first probe and while the breaker lets requests through."""
+        if GursHttpClient.breaker.is_open():
+            return False
+        return self.available is not False
+
+    def probe(self):
+        """Start a probe in a background thread unless one is already running"""
+        with self._lock:
+            if self._probe_running:
+                return
+            self._probe_running = True
+        threading.Thread(target=self._run_probe, daemon=True).start()
+
+    def _run_probe(self):
+        # The probe request itself reports its outcome to the circuit breaker
+        try:
+            available = is_wfs_accessible()
+        finally:
+            with self._lock:
+                self._probe_running = False
+        if available != self.available:
+            self.available = available
+            self.availabilityChanged.emit(available)
+
+
+health_monitor = WfsHealthMonitor()
@@ -0,0 +1,410 @@
+"""
+Shared HTTP client for the GURS web services.
+Keeps one pooled keep-alive session per QGIS process, retries transient failures
+and paces all traffic to ipi.eprostor.gov.si through one rate limiter.
+"""
+
+import random
+import socket
+import threading
+import time
+import weakref
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from qgis.core import QgsMessageLog, Qgis, QgsNetworkAccessManager
+from qgis.PyQt.QtNetwork import QNetworkRequest
+
+from .si_kataster_settings import setting_value
+
+
+MESSAGE_CATEGORY = 'SiKataster'
+
+GURS_HOST = 'ipi.eprostor.gov.si'
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+THROTTLE_STATUS_CODES = (429, 503)
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of sending a request while the GURS server is known to be down"""
+
+
+class RequestCanceledError(requests.RequestException):
+    """Raised when the QgsFeedback of a request was canceled"""
+
+
+def abort_response(response):
+    """Shut down the socket of a streamed response from another thread.
+
+    A read blocked on the socket returns at once, the reading thread then
+    closes the response as usual.
+    """
+    connection = getattr(response.raw, '_connection', None)
+    sock = getattr(connection, 'sock', None)
+    if sock is None:
+        # Connection: close and HTTP/1.0 responses are detached from their
+        # connection, the socket is only reachable through the http.client response
+        fp = getattr(getattr(response.raw, '_fp', None), 'fp', None)
+        sock = getattr(getattr(fp, 'raw', None), '_sock', None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delay or HTTP date), None if absent or invalid"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """Token bucket with a cap on concurrent requests, shared by all GURS traffic.
+
+    Tokens refill at http/rate_per_s up to http/burst, at most
+    http/max_concurrent requests are open at once. 429 and 503 answers halve
+    the rate (down to MIN_FACTOR of the configured one) and honour
+    Retry-After, every other answer lets it recover by RECOVERY per request.
+    Changes of the effective rate are logged.
+    """
+
+    MIN_FACTOR = 1 / 16
+    RECOVERY = 1.05
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.tokens = None
+        self.updated = time.monotonic()
+        self.active = 0
+        self.factor = 1.0
+        self.blocked_until = 0
+
+    def rate(self):
+        return max(setting_value('http/rate_per_s') * self.factor, 0.01)
+
+    def _refill(self, now):
+        burst = max(1, setting_value('http/burst'))
+        if self.tokens is None:
+            self.tokens = burst
+        self.tokens = min(burst, self.tokens + (now - self.updated) * self.rate())
+        self.updated = now
+
+    def acquire(self, feedback=None):
+        """Wait for a token and a free slot, release() the slot when the request is done"""
+        started = time.monotonic()
+        with self.condition:
+            while True:
+                if feedback is not None and feedback.isCanceled():
+                    raise RequestCanceledError("preklicano med čakanjem na omejitev zahtev")
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.active >= max(1, setting_value('http/max_concurrent')):
+                    wait = 0.1
+                elif self.tokens < 1:
+                    wait = (1 - self.tokens) / self.rate()
+                else:
+                    self.tokens -= 1
+                    self.active += 1
+                    break
+                # short waits, so a canceled feedback is noticed
+                self.condition.wait(min(wait, 0.1))
+        waited = time.monotonic() - started
+        if waited >= 1:
+            QgsMessageLog.logMessage(f"Omejitev zahtev: čakanje {waited:.1f}s, {self.state_text()}", MESSAGE_CATEGORY, Qgis.Info)
+
+    def release(self):
+        with self.condition:
+            self.active = max(0, self.active - 1)
+            self.condition.notify_all()
+
+    def release_with(self, response, stream=False):
+        """Release the slot now, or when a streamed response is closed (or collected)"""
+        if not stream:
+            self.release()
+            return
+        released = threading.Event()
+
+        def release_once():
+            if not released.is_set():
+                released.set()
+                self.release()
+
+        # no strong reference back to the response, so the finalizer runs
+        # as soon as it is dropped and not only after a cyclic collection
+        response_ref = weakref.ref(response)
+        close = type(response).close
+
+        def close_and_release():
+            try:
+                alive = response_ref()
+                if alive is not None:
+                    close(alive)
+            finally:
+                release_once()
+
+        response.close = close_and_release
+        weakref.finalize(response, release_once)
+
+    def consume(self):
+        """Take a token without waiting, for requests that cannot be held back"""
+        with self.condition:
+            self._refill(time.monotonic())
+            self.tokens = max(self.tokens - 1, -max(1, setting_value('http/burst')))
+
+    def record_status(self, status_code, retry_after=None):
+        """Adapt the rate to the answer of the server"""
+        with self.condition:
+            old_factor = self.factor
+            if status_code in THROTTLE_STATUS_CODES:
+                self.factor = max(self.MIN_FACTOR, self.factor / 2)
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            elif status_code < 500 and self.factor < 1:
+                self.factor = min(1.0, self.factor * self.RECOVERY)
+            changed = self.factor != old_factor
+        if status_code in THROTTLE_STATUS_CODES:
+            retry = f", Retry-After {retry_after:.0f}s" if retry_after else ""
+            QgsMessageLog.logMessage(f"GURS omejuje zahteve (HTTP {status_code}{retry}), {self.state_text()}", MESSAGE_CATEGORY, Qgis.Warning)
+        elif changed and self.factor == 1:
+            QgsMessageLog.logMessage(f"Omejitev zahtev sproščena, {self.state_text()}", MESSAGE_CATEGORY, Qgis.Info)
+
+    def state_text(self):
+        return (f"{self.rate():.2f} zahtev/s (nastavljeno {setting_value('http/rate_per_s')}), "
+                f"v teku {self.active}/{setting_value('http/max_concurrent')}")
+
+
+class CircuitBreaker:
+    """Stops requests to a failing server for a while instead of letting each one time out.
+
+    After breaker/failures consecutive failures the circuit opens and requests
+    fail immediately. After breaker/reset_s one trial request is let through,
+    its outcome closes or reopens the circuit; other requests keep failing
+    until then. A trial that ends without an outcome (canceled, throttled)
+    is replaced by a new one after another breaker/reset_s.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.trial_started = 0
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.time() - self.opened_at < setting_value('breaker/reset_s'):
+                    return False
+            elif time.time() - self.trial_started < setting_value('breaker/reset_s'):
+                # the trial request is still in flight
+                return False
+            self.state = self.HALF_OPEN
+            self.trial_started = time.time()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                QgsMessageLog.logMessage("Strežnik GURS je spet dostopen", MESSAGE_CATEGORY, Qgis.Info)
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= setting_value('breaker/failures'):
+                if self.state != self.OPEN:
+                    QgsMessageLog.logMessage("Strežnik GURS ni dostopen, zahteve so začasno ustavljene", MESSAGE_CATEGORY, Qgis.Warning)
+                self.state = self.OPEN
+                self.opened_at = time.time()
+
+    def is_open(self):
+        with self._lock:
+            return self.state == self.OPEN
+
+
+class GursHttpClient:
+    """Process-wide pooled session used by every request to ipi.eprostor.gov.si"""
+
+    _shared_session = None
+    _lock = threading.Lock()
+    breaker = CircuitBreaker()
+    limiter = RateLimiter()
+
+    @classmethod
+    def get_session(cls):
+        """Return the shared session, creating it on first use"""
+        with cls._lock:
+            if cls._shared_session is None:
+                pool_size = max(10, setting_value('wfs/max_workers') * 2)
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update({
+                    'Accept-Encoding': 'gzip, deflate',
+                    'Connection': 'keep-alive',
+                    'User-Agent': 'SiKataster QGIS plugin',
+                })
+                cls._shared_session = session
+            return cls._shared_session
+
+    @classmethod
+    def close_shared_session(cls):
+        """Close pooled connections, the next request opens a new session"""
+        with cls._lock:
+            if cls._shared_session is not None:
+                cls._shared_session.close()
+                cls._shared_session = None
+
+    @classmethod
+    def backoff_delay(cls, attempt):
+        """Exponential backoff with full jitter for the given retry attempt (0-based)"""
+        base = setting_value('http/backoff')
+        cap = setting_value('http/backoff_max')
+        return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+    @classmethod
+    def request(cls, method, url, retries=None, probe=False, feedback=None, **kwargs):
+        """Send a request over the shared session.
+
+        Timeouts, connection errors and 5xx responses are retried up to
+        retries times (setting http/retries by default), 429 and 503 wait at
+        least as long as Retry-After asks. The last response is returned as
+        is, the caller decides what a non-2xx status means.
+        Every attempt passes the rate limiter first.
+        While the circuit breaker is open CircuitOpenError is raised at once,
+        probe requests of the health monitor bypass it. Once feedback is
+        canceled no further attempt is made and RequestCanceledError is raised.
+        """
+        if not probe and not cls.breaker.allow_request():
+            raise CircuitOpenError(f"{url}: strežnik ni dostopen")
+        if retries is None:
+            retries = setting_value('http/retries')
+        stream = kwargs.get('stream', False)
+        attempt = 0
+        while True:
+            if feedback is not None and feedback.isCanceled():
+                raise RequestCanceledError(f"{method} {url}: preklicano")
+            cls.limiter.acquire(feedback)
+            retry_after = None
+            try:
+                response = cls.get_session().request(method, url, **kwargs)
+            except (requests.Timeout, requests.ConnectionError) as e:
+                cls.limiter.release()
+                if attempt >= retries:
+                    cls.breaker.record_failure()
+                    raise
+                reason = type(e).__name__
+            except BaseException:
+                cls.limiter.release()
+                raise
+            else:
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                cls.limiter.record_status(response.status_code, retry_after)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    cls.breaker.record_success()
+                    cls.limiter.release_with(response, stream)
+                    return response
+                if attempt >= retries:
+                    # throttling is not an outage
+                    if response.status_code != 429:
+                        cls.breaker.record_failure()
+                    cls.limiter.release_with(response, stream)
+                    return response
+                reason = f"HTTP {response.status_code}"
+                response.close()
+                cls.limiter.release()
+
+            delay = max(cls.backoff_delay(attempt), retry_after or 0)
+            QgsMessageLog.logMessage(
+                f"{method} {url}: {reason}, ponovni poskus {attempt + 1}/{retries} čez {delay:.1f}s",
+                MESSAGE_CATEGORY,
+                Qgis.Info
+            )
+            cls.wait(delay, feedback)
+            attempt += 1
+
+    @classmethod
+    def wait(cls, delay, feedback=None):
+        """Sleep for delay seconds, waking up early when feedback is canceled"""
+        deadline = time.monotonic() + delay
+        while feedback is None or not feedback.isCanceled():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, 0.1))
+
+    @classmethod
+    def get(cls, url, **kwargs):
+        return cls.request('GET', url, **kwargs)
+
+    @classmethod
+    def post(cls, url, **kwargs):
+        return cls.request('POST', url, **kwargs)
+
+    @classmethod
+    def head(cls, url, **kwargs):
+        return cls.request('HEAD', url, **kwargs)
+
+
+class QgisNetworkThrottle:
+    """Accounts requests QGIS itself sends to GURS (WFS layers loaded from QLR files).
+
+    They are issued by the QGIS network stack, often on the main thread, so
+    they cannot be held back. Each one takes a token without waiting, which
+    slows down the plugin's own requests, and their 429/503 answers adapt
+    the shared limiter. Request preprocessors need QGIS 3.22 or newer.
+    """
+
+    def __init__(self):
+        self.preprocessor_id = None
+
+    def install(self):
+        if self.preprocessor_id is not None or not hasattr(QgsNetworkAccessManager, 'setRequestPreprocessor'):
+            return
+        self.preprocessor_id = QgsNetworkAccessManager.setRequestPreprocessor(self.preprocess)
+        QgsNetworkAccessManager.instance().finished.connect(self.finished)
+
+    def remove(self):
+        if self.preprocessor_id is None:
+            return
+        QgsNetworkAccessManager.removeRequestPreprocessor(self.preprocessor_id)
+        QgsNetworkAccessManager.instance().finished.disconnect(self.finished)
+        self.preprocessor_id = None
+
+    def preprocess(self, request):
+        if request.url().host() == GURS_HOST:
+            GursHttpClient.limiter.consume()
+
+    def finished(self, reply):
+        if reply.request().url().host() != GURS_HOST:
+            return
+        status_code = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+        if status_code:
+            retry_after = parse_retry_after(bytes(reply.rawHeader(b'Retry-After')).decode('latin-1'))
+            GursHttpClient.limiter.record_status(int(status_code), retry_after)
+
+
+qgis_network_throttle = QgisNetworkThrottle()
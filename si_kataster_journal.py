@@ -0,0 +1,129 @@
+"""
+Journal of completed pages and tiles of bulk WFS downloads.
+A failed or canceled download leaves its journal in the QGIS user profile,
+running the same download again replays the completed units and fetches only the rest.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from qgis.core import QgsMessageLog, Qgis
+
+from .si_kataster_settings import setting_value, plugin_profile_dir
+
+
+MESSAGE_CATEGORY = 'SiKataster'
+
+
+class DownloadJournal:
+    """Completed units (page startIndex or tile number) of one download.
+
+    Each unit is stored as a JSON lines file before it is marked complete in
+    journal.json, so a crash never leaves a half written unit behind.
+    """
+
+    def __init__(self, path, description=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.meta = self._load_meta() or {'created': time.time(), 'description': description, 'number_matched': None, 'units': []}
+        self.units = set(self.meta['units'])
+
+    def _meta_path(self):
+        return os.path.join(self.path, 'journal.json')
+
+    def _unit_path(self, unit):
+        return os.path.join(self.path, f"{unit}.jsonl")
+
+    def _load_meta(self):
+        try:
+            with open(self._meta_path(), encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _save_meta(self):
+        tmp_path = self._meta_path() + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.meta, file)
+        os.replace(tmp_path, self._meta_path())
+
+    @property
+    def number_matched(self):
+        return self.meta.get('number_matched')
+
+    @property
+    def page_step(self):
+        """Features per page the server returned, None if not recorded"""
+        return self.meta.get('page_step')
+
+    def completed(self):
+        return len(self.units)
+
+    def has(self, unit):
+        return str(unit) in self.units
+
+    def read(self, unit):
+        """Features of a completed unit"""
+        with open(self._unit_path(unit), encoding='utf-8') as file:
+            return [json.loads(line) for line in file]
+
+    def commit(self, unit, features, number_matched=None, page_step=None):
+        """Store the features of a completed unit"""
+        tmp_path = f"{self._unit_path(unit)}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            for feature in features:
+                file.write(json.dumps(feature, ensure_ascii=False))
+                file.write('\n')
+        os.replace(tmp_path, self._unit_path(unit))
+        with self.lock:
+            self.units.add(str(unit))
+            self.meta['units'] = sorted(self.units)
+            if number_matched is not None:
+                self.meta['number_matched'] = number_matched
+            if page_step is not None:
+                self.meta['page_step'] = page_step
+            self._save_meta()
+
+    def finish(self):
+        """The download was consumed completely, the journal is no longer needed"""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class DownloadJournalStore:
+    """Journals keyed by the parameters of a download, kept for journal/max_age_hours"""
+
+    def journal_dir(self):
+        return plugin_profile_dir('journal')
+
+    def key(self, *parts):
+        raw = json.dumps(parts, default=str)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def open(self, *parts, description=None):
+        """Journal of the download identified by parts, resumed if one exists"""
+        self.expire()
+        path = os.path.join(self.journal_dir(), self.key(*parts))
+        resumed = os.path.exists(path)
+        os.makedirs(path, exist_ok=True)
+        journal = DownloadJournal(path, description)
+        if resumed and journal.completed():
+            QgsMessageLog.logMessage(f"Nadaljujem prenos {description or ''}: {journal.completed()} že prenesenih delov", MESSAGE_CATEGORY, Qgis.Info)
+        return journal
+
+    def expire(self):
+        max_age = setting_value('journal/max_age_hours') * 3600
+        for name in os.listdir(self.journal_dir()):
+            path = os.path.join(self.journal_dir(), name)
+            if time.time() - os.path.getmtime(path) > max_age:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def clear(self):
+        for name in os.listdir(self.journal_dir()):
+            shutil.rmtree(os.path.join(self.journal_dir(), name), ignore_errors=True)
+
+
+download_journals = DownloadJournalStore()
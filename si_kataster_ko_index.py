@@ -0,0 +1,170 @@
+"""
+Search index over the KO directory for the KO completer.
+Names are folded (no diacritics, lower case) so "cermozise" finds "ČERMOŽIŠE",
+candidates come from a trigram index and are ranked by prefix match and edit distance.
+"""
+
+import unicodedata
+from collections import defaultdict, namedtuple
+
+from qgis.PyQt.QtCore import Qt, QAbstractListModel, QModelIndex
+
+
+# Letters without a canonical decomposition
+FOLD_TABLE = str.maketrans({'đ': 'd', 'Đ': 'd', 'ß': 'ss'})
+
+NGRAM_SIZE = 3
+
+KoEntry = namedtuple('KoEntry', ['ko_id', 'naziv', 'label', 'folded', 'words'])
+
+
+def fold(text):
+    """Lower case text without diacritics, 'Čermožiše' -> 'cermozise'"""
+    text = str(text).translate(FOLD_TABLE)
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower().strip()
+
+
+def ngrams(text, size=NGRAM_SIZE):
+    padded = f' {text} '
+    return {padded[i:i + size] for i in range(max(len(padded) - size + 1, 1))}
+
+
+def edit_distance(query, target, limit, prefix=False):
+    """Levenshtein distance of query and target, or limit + 1 once it is certain to exceed limit.
+
+    With prefix=True the distance to the closest prefix of target is returned,
+    so a partially typed name is not penalised for the letters still missing.
+    """
+    if not prefix and abs(len(query) - len(target)) > limit:
+        return limit + 1
+    previous = list(range(len(target) + 1))
+    for i, cq in enumerate(query, 1):
+        current = [i]
+        for j, ct in enumerate(target, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (cq != ct)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous) if prefix else previous[-1]
+
+
+class KoSearchIndex:
+    """Precomputed search index over a {KO_ID: NAZIV} directory"""
+
+    # ranks, lower is better
+    RANK_PREFIX = 0
+    RANK_WORD_PREFIX = 1
+    RANK_CONTAINS = 2
+    RANK_FUZZY = 3
+
+    def __init__(self, ko_dict):
+        self.entries = []
+        self.grams = defaultdict(set)
+        for ko_id, naziv in ko_dict.items():
+            folded = fold(naziv)
+            entry = KoEntry(str(ko_id), naziv, f"{ko_id} - {naziv}", folded, folded.replace('-', ' ').split())
+            position = len(self.entries)
+            self.entries.append(entry)
+            for gram in ngrams(folded):
+                self.grams[gram].add(position)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def search(self, text, limit=50):
+        """Entries matching text, best first"""
+        query = fold(text)
+        if not query:
+            return []
+        # "1234 - NAZIV" as set by the completer itself
+        if ' - ' in query:
+            query = query.split(' - ', 1)[0].strip()
+        if query.isdigit():
+            matches = [e for e in self.entries if e.ko_id.startswith(query)]
+            matches.sort(key=lambda e: (len(e.ko_id), e.ko_id))
+            return matches[:limit]
+
+        scored = {}
+        for position in self._candidates(query):
+            rank = self._rank(self.entries[position], query)
+            if rank is not None:
+                scored[position] = (rank, 0)
+        if len(scored) < limit and len(query) >= NGRAM_SIZE:
+            max_distance = max(1, len(query) // 3)
+            for position in self._fuzzy_candidates(query):
+                if position in scored:
+                    continue
+                distance = self._distance(self.entries[position], query, max_distance)
+                if distance <= max_distance:
+                    scored[position] = (self.RANK_FUZZY, distance)
+
+        ordered = sorted(scored, key=lambda p: (scored[p], len(self.entries[p].folded), self.entries[p].folded))
+        return [self.entries[p] for p in ordered[:limit]]
+
+    def _candidates(self, query):
+        """Positions whose folded name can contain query"""
+        if len(query) < NGRAM_SIZE:
+            return range(len(self.entries))
+        # inner trigrams only, the padded ones would require a word boundary
+        grams = [query[i:i + NGRAM_SIZE] for i in range(len(query) - NGRAM_SIZE + 1)]
+        postings = sorted((self.grams.get(gram, set()) for gram in grams), key=len)
+        return set.intersection(*postings) if postings else set()
+
+    def _fuzzy_candidates(self, query):
+        """Positions sharing at least a third of the query trigrams"""
+        grams = ngrams(query)
+        counts = defaultdict(int)
+        for gram in grams:
+            for position in self.grams.get(gram, ()):
+                counts[position] += 1
+        threshold = max(1, len(grams) // 3)
+        return [position for position, count in counts.items() if count >= threshold]
+
+    def _rank(self, entry, query):
+        if entry.folded.startswith(query):
+            return self.RANK_PREFIX
+        if any(word.startswith(query) for word in entry.words):
+            return self.RANK_WORD_PREFIX
+        if query in entry.folded:
+            return self.RANK_CONTAINS
+        return None
+
+    def _distance(self, entry, query, limit):
+        """Edit distance of query to the closest prefix of the name or one of its words"""
+        return min(edit_distance(query, target, limit, prefix=True) for target in [entry.folded] + entry.words)
+
+
+class KoCompleterModel(QAbstractListModel):
+    """Completer model showing the ranked KO matches of the current query.
+
+    Use with QCompleter.UnfilteredPopupCompletion and call set_query on textEdited,
+    the completer itself does not filter.
+    """
+
+    def __init__(self, parent=None, limit=50):
+        super().__init__(parent)
+        self.index = KoSearchIndex({})
+        self.limit = limit
+        self.query = ''
+        self.rows = []
+
+    def set_index(self, index):
+        self.index = index
+        self.set_query(self.query)
+
+    def set_query(self, text):
+        self.beginResetModel()
+        self.query = text
+        self.rows = self.index.search(text, self.limit)
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self.rows):
+            return None
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return self.rows[index.row()].label
+        return None
@@ -0,0 +1,54 @@
+"""
+Provenance metadata of the layers and files the plugin creates.
+History items and source links are assembled in memory and applied with a single setMetadata call.
+"""
+
+from datetime import datetime
+
+from qgis.core import QgsAbstractMetadataBase, QgsLayerMetadata
+from qgis.PyQt.QtCore import QCoreApplication
+
+
+def tr(message):
+    return QCoreApplication.translate('SiKataster', message)
+
+
+class ProvenanceBuilder:
+    """Collects history and links for one layer or output file.
+
+    Start from the metadata of the layer the data came from (if any), add
+    the fetches that produced the data and apply it to one or more layers.
+    Applying never puts a layer into edit mode.
+    """
+
+    def __init__(self, base_metadata=None):
+        self.metadata = QgsLayerMetadata(base_metadata) if base_metadata is not None else QgsLayerMetadata()
+
+    @classmethod
+    def from_layer(cls, layer):
+        return cls(layer.metadata())
+
+    def add_history(self, history):
+        self.metadata.addHistoryItem(str(history))
+        return self
+
+    def add_source(self, title, source, link_type='OGC:WFS', time_now=None, process='prevzem sloja'):
+        """Record that the data titled title was fetched from source at time_now"""
+        time_now = time_now or datetime.now()
+        self.add_history({
+            'timestamp': time_now.isoformat(),
+            'process': process,
+            'title': title,
+            'source': source
+        })
+        link = QgsAbstractMetadataBase.Link(name=tr('Vir podatkov'), type=link_type, url=source)
+        link.description = tr('Dostop') + ': ' + str(time_now)
+        self.metadata.addLink(link)
+        return self
+
+    def apply(self, layer, save=False):
+        """Set the assembled metadata on layer, save=True also stores it with a file based layer"""
+        layer.setMetadata(QgsLayerMetadata(self.metadata))
+        if save:
+            layer.saveDefaultMetadata()
+        return layer
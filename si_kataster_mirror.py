@@ -0,0 +1,293 @@
+"""
+Local GeoPackage mirror of OSNOVNI_PARCELE for selected cadastral municipalities (KO).
+Parcels and KO boundaries are kept in one GeoPackage in the QGIS user profile,
+both layers carry an R-tree spatial index.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import datetime
+
+from qgis.core import (QgsVectorLayer, QgsVectorFileWriter, QgsCoordinateReferenceSystem, QgsCoordinateTransformContext,
+                       QgsFeatureRequest, QgsGeometry, QgsWkbTypes, QgsMessageLog, Qgis)
+
+from qgis.PyQt.QtCore import QCoreApplication
+
+from .si_kataster_metadata import ProvenanceBuilder
+from .si_kataster_settings import plugin_profile_dir
+
+
+MESSAGE_CATEGORY = 'SiKataster'
+
+PARCEL_LAYER = 'osnovni_parcele'
+KO_LAYER = 'katastrske_obcine'
+
+
+def tr(message):
+    return QCoreApplication.translate('SiKataster', message)
+
+
+class ParcelMirror:
+    """GeoPackage store of whole KOs, mirrored from the GURS WFS"""
+
+    def __init__(self, file_name='parcele.gpkg', index_name='ko.json'):
+        # lock guards the KO index, write_lock serializes writers of the GeoPackage
+        self.lock = threading.RLock()
+        self.write_lock = threading.Lock()
+        self.file_name = file_name
+        self.index_name = index_name
+
+    def path(self):
+        return os.path.join(plugin_profile_dir('mirror'), self.file_name)
+
+    def index_path(self):
+        return os.path.join(plugin_profile_dir('mirror'), self.index_name)
+
+    def mirrored_kos(self):
+        """Return {KO_ID: fetch timestamp} of mirrored KOs"""
+        with self.lock:
+            if not os.path.exists(self.index_path()):
+                return {}
+            with open(self.index_path(), encoding='utf-8') as file:
+                return json.load(file)
+
+    def has_ko(self, ko_id):
+        return str(ko_id) in self.mirrored_kos()
+
+    def layer(self, layer_name=PARCEL_LAYER, path=None):
+        """Open a mirror layer, None if nothing was mirrored yet"""
+        path = path or self.path()
+        if not os.path.exists(path):
+            return None
+        layer = QgsVectorLayer(f"{path}|layername={layer_name}", layer_name, "ogr")
+        return layer if layer.isValid() else None
+
+    def _create_writer(self, layer_name, fields, crs, overwrite_file=False, path=None):
+        path = path or self.path()
+        options = QgsVectorFileWriter.SaveVectorOptions()
+        options.driverName = 'GPKG'
+        options.layerName = layer_name
+        options.layerOptions = ['SPATIAL_INDEX=YES']
+        if os.path.exists(path) and not overwrite_file:
+            options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteLayer
+        writer = QgsVectorFileWriter.create(path, fields, QgsWkbTypes.MultiPolygon,
+                                            QgsCoordinateReferenceSystem(crs), QgsCoordinateTransformContext(), options)
+        if writer.hasError() != QgsVectorFileWriter.NoError:
+            raise IOError(writer.errorMessage())
+        return writer
+
+    def _create_layer(self, layer_name, fields, crs):
+        writer = self._create_writer(layer_name, fields, crs)
+        del writer
+        self.create_attribute_index(layer_name)
+        return self.layer(layer_name)
+
+    def create_attribute_index(self, layer_name=PARCEL_LAYER, path=None):
+        """Index (KO_ID, ST_PARCELE) of the parcel layer, KO_ID of the KO layer"""
+        columns = '"KO_ID", "ST_PARCELE"' if layer_name == PARCEL_LAYER else '"KO_ID"'
+        with closing(sqlite3.connect(path or self.path())) as connection:
+            connection.execute(f'CREATE INDEX IF NOT EXISTS "idx_{layer_name}_ko" ON "{layer_name}" ({columns})')
+            connection.commit()
+
+    def _replace(self, layer_name, ko_id, fields, crs, feature_batches):
+        layer = self.layer(layer_name) or self._create_layer(layer_name, fields, crs)
+        provider = layer.dataProvider()
+        request = QgsFeatureRequest().setFilterExpression(f'"KO_ID" = {int(ko_id)}')
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        provider.deleteFeatures([feature.id() for feature in layer.getFeatures(request)])
+        count = 0
+        for batch in feature_batches:
+            if not provider.addFeatures(batch):
+                raise IOError('; '.join(provider.errors()))
+            count += len(batch)
+        return layer, count
+
+    def replace_ko(self, ko_id, fields, crs, parcel_batches, boundary_batches, source):
+        """Replace all parcels and the boundary of one KO and record the fetch date.
+
+        parcel_batches and boundary_batches are iterables of QgsFeature lists,
+        usually lazy downloads. The KO leaves the index while it is replaced,
+        so a half replaced KO is never served, and the index lock is only taken
+        to update the index; readers do not wait for the download.
+        """
+        self._forget_ko(ko_id)
+        with self.write_lock:
+            layer, count = self._replace(PARCEL_LAYER, ko_id, fields[0], crs, parcel_batches)
+            self._replace(KO_LAYER, ko_id, fields[1], crs, boundary_batches)
+            time_now = datetime.now()
+            self.update_metadata(layer, source, time_now, f"K. O. {ko_id}")
+
+        with self.lock:
+            kos = self.mirrored_kos()
+            kos[str(ko_id)] = time_now.isoformat()
+            with open(self.index_path(), 'w', encoding='utf-8') as file:
+                json.dump(kos, file)
+        QgsMessageLog.logMessage(f"Lokalno zrcalo: K. O. {ko_id}, {count} parcel", MESSAGE_CATEGORY, Qgis.Info)
+        return count
+
+    def _forget_ko(self, ko_id):
+        with self.lock:
+            kos = self.mirrored_kos()
+            if kos.pop(str(ko_id), None) is not None:
+                with open(self.index_path(), 'w', encoding='utf-8') as file:
+                    json.dump(kos, file)
+
+    def update_metadata(self, layer, source, time_now, title):
+        """Record the fetch in the metadata stored with the GeoPackage layer"""
+        ProvenanceBuilder.from_layer(layer).add_source(title, source, time_now=time_now).apply(layer, save=True)
+
+    def remove_all(self):
+        """Delete the whole mirror"""
+        with self.lock:
+            for path in (self.path(), self.index_path()):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def find_parcel(self, ko_id, st_parcele):
+        """Return a memory layer with the matching parcel, empty if not found"""
+        layer = self.layer()
+        request = QgsFeatureRequest().setFilterExpression(
+            f""""KO_ID" = {int(ko_id)} AND "ST_PARCELE" = '{st_parcele.replace("'", "''")}'""")
+        result = layer.materialize(request)
+        result.setMetadata(layer.metadata())
+        return result
+
+    def covers(self, geometry):
+        """True if geometry lies completely inside the mirrored KOs.
+
+        Only KOs in the index count, the boundary of a KO whose refresh failed
+        may still be in the GeoPackage while its parcels are incomplete.
+        """
+        ko_ids = [int(ko_id) for ko_id in self.mirrored_kos()]
+        ko_layer = self.layer(KO_LAYER)
+        if ko_layer is None or not ko_ids:
+            return False
+        request = QgsFeatureRequest().setFilterExpression(f'"KO_ID" IN ({", ".join(map(str, ko_ids))})')
+        request.setFilterRect(geometry.boundingBox())
+        parts = [feature.geometry() for feature in ko_layer.getFeatures(request)]
+        if not parts:
+            return False
+        return QgsGeometry.unaryUnion(parts).contains(geometry)
+
+
+class ParcelSnapshot(ParcelMirror):
+    """Parcels of the whole country imported from a GURS bulk download file.
+
+    Once imported it answers for every KO and every area.
+    """
+
+    BATCH_SIZE = 10000
+
+    def __init__(self):
+        super().__init__('nacionalni.gpkg', 'nacionalni.json')
+
+    def info(self):
+        """Return {'source': ..., 'imported': ..., 'features': ...} or None"""
+        with self.lock:
+            if not os.path.exists(self.index_path()) or not os.path.exists(self.path()):
+                return None
+            with open(self.index_path(), encoding='utf-8') as file:
+                return json.load(file)
+
+    def mirrored_kos(self):
+        return {}
+
+    def has_ko(self, ko_id):
+        return self.info() is not None
+
+    def covers(self, geometry):
+        return self.info() is not None
+
+    def import_snapshot(self, source_path, set_progress=None, is_canceled=None):
+        """Stream a bulk parcel file (SHP, GPKG, zip, ...) into the snapshot GeoPackage.
+
+        Features are copied in batches of BATCH_SIZE and reprojected to EPSG:3794,
+        memory use does not depend on the size of the file. The import is written
+        to a temporary GeoPackage that replaces the snapshot only once it is
+        complete, the old snapshot keeps answering meanwhile and survives a
+        cancel or an error. Returns the number of imported parcels, None if cancelled.
+        """
+        uri = f"/vsizip/{source_path}" if source_path.lower().endswith('.zip') else source_path
+        source = QgsVectorLayer(uri, 'uvoz', 'ogr')
+        if not source.isValid():
+            raise IOError(tr(f'Datoteke {source_path} ni mogoče odpreti'))
+        missing = [name for name in ('KO_ID', 'ST_PARCELE') if source.fields().lookupField(name) < 0]
+        if missing:
+            raise ValueError(tr(f"V datoteki manjkajo polja: {', '.join(missing)}"))
+
+        crs = 'EPSG:3794'
+        total = max(source.featureCount(), 1)
+        request = QgsFeatureRequest().setDestinationCrs(QgsCoordinateReferenceSystem(crs), QgsCoordinateTransformContext())
+        tmp_path = f"{os.path.splitext(self.path())[0]}.{threading.get_ident()}.tmp.gpkg"
+        tmp_index_path = f"{self.index_path()}.{threading.get_ident()}.tmp"
+        try:
+            writer = self._create_writer(PARCEL_LAYER, source.fields(), crs, overwrite_file=True, path=tmp_path)
+            start_time = time.time()
+            count = 0
+            batch = []
+            for feature in source.getFeatures(request):
+                batch.append(feature)
+                if len(batch) < self.BATCH_SIZE:
+                    continue
+                if is_canceled and is_canceled():
+                    del writer
+                    return None
+                if not writer.addFeatures(batch):
+                    raise IOError(writer.errorMessage())
+                count += len(batch)
+                batch = []
+                if set_progress:
+                    set_progress(min(99, 100 * count / total))
+                if count % (self.BATCH_SIZE * 10) == 0:
+                    elapsed = time.time() - start_time
+                    QgsMessageLog.logMessage(f"Uvoz posnetka: {count} parcel, {count / elapsed:.0f} parcel/s",
+                                             MESSAGE_CATEGORY, Qgis.Info)
+            if batch and not writer.addFeatures(batch):
+                raise IOError(writer.errorMessage())
+            count += len(batch)
+            del writer
+            self.create_attribute_index(PARCEL_LAYER, path=tmp_path)
+            elapsed = time.time() - start_time
+
+            time_now = datetime.now()
+            layer = self.layer(path=tmp_path)
+            self.update_metadata(layer, source_path, time_now, tr('Državni posnetek parcel'))
+            del layer
+            with open(tmp_index_path, 'w', encoding='utf-8') as file:
+                json.dump({'source': source_path, 'imported': time_now.isoformat(), 'features': count}, file)
+            with self.lock:
+                os.replace(tmp_path, self.path())
+                os.replace(tmp_index_path, self.index_path())
+        finally:
+            for path in (tmp_path, tmp_index_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        QgsMessageLog.logMessage(f"Uvoz posnetka končan: {count} parcel v {elapsed:.0f}s ({count / max(elapsed, 0.001):.0f} parcel/s)",
+                                 MESSAGE_CATEGORY, Qgis.Info)
+        return count
+
+
+parcel_mirror = ParcelMirror()
+parcel_snapshot = ParcelSnapshot()
+
+
+def local_store_for_ko(ko_id):
+    """Local parcel store that can answer for the KO, None if only the WFS can"""
+    for store in (parcel_mirror, parcel_snapshot):
+        if store.has_ko(ko_id):
+            return store
+    return None
+
+
+def local_store_for_area(geometry):
+    """Local parcel store covering the whole geometry, None if only the WFS can"""
+    for store in (parcel_mirror, parcel_snapshot):
+        if store.covers(geometry):
+            return store
+    return None
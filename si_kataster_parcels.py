@@ -0,0 +1,177 @@
+"""
+Parcel numbers (ST_PARCELE) of a cadastral municipality for the parcel completer.
+Lists are cached per KO in the QGIS user profile in natural order (main number, then sub-number),
+a prefix index answers completer queries with two binary searches.
+"""
+
+import bisect
+import heapq
+import json
+import os
+import re
+import threading
+import time
+from array import array
+
+from qgis.core import QgsMessageLog, Qgis
+from qgis.PyQt.QtCore import Qt, QAbstractListModel, QModelIndex
+
+from .si_kataster_settings import setting_value, plugin_profile_dir
+
+
+MESSAGE_CATEGORY = 'SiKataster'
+
+PARCEL_NUMBER_RE = re.compile(r'^\s*(\d+)\s*(?:/\s*(\d+))?\s*$')
+
+
+def parcel_sort_key(number):
+    """Natural sort key, '2' < '10' < '10/1' < '10/12' < '123/4'; unparsable numbers go last"""
+    match = PARCEL_NUMBER_RE.match(str(number))
+    if match is None:
+        return (1, 0, 0, str(number))
+    return (0, int(match.group(1)), int(match.group(2) or 0), str(number))
+
+
+class ParcelNumberIndex:
+    """Parcel numbers of one KO in natural order with a prefix index.
+
+    lex_order holds the natural positions of the numbers sorted as strings,
+    a prefix is a contiguous range of it.
+    """
+
+    def __init__(self, numbers, presorted=False):
+        self.numbers = list(numbers) if presorted else sorted(set(numbers), key=parcel_sort_key)
+        self.lex_order = array('I', sorted(range(len(self.numbers)), key=self.numbers.__getitem__))
+        self.lex_keys = [self.numbers[position] for position in self.lex_order]
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __contains__(self, number):
+        position = bisect.bisect_left(self.lex_keys, number)
+        return position < len(self.lex_keys) and self.lex_keys[position] == number
+
+    def prefix_range(self, prefix):
+        """Range of lex_order with numbers starting with prefix"""
+        prefix = prefix.strip()
+        return bisect.bisect_left(self.lex_keys, prefix), bisect.bisect_left(self.lex_keys, prefix + '\uffff')
+
+    def count(self, prefix=''):
+        start, end = self.prefix_range(prefix)
+        return end - start
+
+    def positions(self, prefix=''):
+        """Natural positions of the numbers starting with prefix, in natural order"""
+        if not prefix.strip():
+            return range(len(self.numbers))
+        start, end = self.prefix_range(prefix)
+        return array('I', sorted(self.lex_order[start:end]))
+
+    def lookup(self, prefix='', limit=None):
+        """Numbers starting with prefix in natural order"""
+        if not prefix.strip():
+            return self.numbers[:limit]
+        start, end = self.prefix_range(prefix)
+        positions = self.lex_order[start:end]
+        positions = sorted(positions) if limit is None else heapq.nsmallest(limit, positions)
+        return [self.numbers[position] for position in positions]
+
+
+class ParcelCompleterModel(QAbstractListModel):
+    """Lazy completer model over a ParcelNumberIndex.
+
+    Only the positions of the matching numbers are kept, rows are handed out
+    FETCH_SIZE at a time as the popup scrolls. The index can be swapped while
+    pages are still arriving, the current query is kept.
+    """
+
+    FETCH_SIZE = 100
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.index = ParcelNumberIndex([])
+        self.query = ''
+        self.matches = range(0)
+        self.loaded = 0
+
+    def set_index(self, index):
+        self.index = index
+        self.set_query(self.query)
+
+    def set_query(self, text):
+        self.beginResetModel()
+        self.query = text
+        self.matches = self.index.positions(text)
+        self.loaded = min(self.FETCH_SIZE, len(self.matches))
+        self.endResetModel()
+
+    def match_count(self):
+        return len(self.matches)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.loaded
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.loaded < len(self.matches)
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        count = min(self.FETCH_SIZE, len(self.matches) - self.loaded)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self.loaded, self.loaded + count - 1)
+        self.loaded += count
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < self.loaded:
+            return None
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return self.index.numbers[self.matches[index.row()]]
+        return None
+
+
+class ParcelNumberCache:
+    """Per-KO parcel number lists, fresh for parcels/ttl_hours"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def cache_dir(self):
+        return plugin_profile_dir('cache', 'parcels')
+
+    def path(self, ko_id):
+        return os.path.join(self.cache_dir(), f"{int(ko_id)}.json")
+
+    def load(self, ko_id):
+        """Return (ParcelNumberIndex, created) of a cached KO or None"""
+        try:
+            with open(self.path(ko_id), encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return None
+        return ParcelNumberIndex(data['numbers'], presorted=True), data.get('created', 0)
+
+    def is_fresh(self, created):
+        return time.time() - created < setting_value('parcels/ttl_hours') * 3600
+
+    def save(self, ko_id, index):
+        path = self.path(ko_id)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({'ko_id': int(ko_id), 'created': time.time(), 'numbers': index.numbers}, file, ensure_ascii=False)
+        with self.lock:
+            os.replace(tmp_path, path)
+
+    def clear(self):
+        with self.lock:
+            removed = 0
+            for name in os.listdir(self.cache_dir()):
+                if name.endswith('.json'):
+                    os.remove(os.path.join(self.cache_dir(), name))
+                    removed += 1
+        QgsMessageLog.logMessage(f"Predpomnilnik številk parcel počiščen ({removed} K. O.)", MESSAGE_CATEGORY, Qgis.Info)
+
+
+parcel_number_cache = ParcelNumberCache()
@@ -0,0 +1,120 @@
+"""
+Progress of WFS downloads: bytes received, features decoded, pages and tiles completed.
+The pipeline reports into a WfsFeedback, tasks show its status in the task bar and the dock.
+"""
+
+import threading
+import time
+
+from qgis.core import QgsFeedback
+from qgis.PyQt.QtCore import QCoreApplication, pyqtSignal
+
+
+def tr(message):
+    return QCoreApplication.translate('SiKataster', message)
+
+
+def format_count(count):
+    """Whole number with dots as thousands separators, 12345 -> '12.345'"""
+    return f"{int(count):,}".replace(',', '.')
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds} s"
+    if seconds < 3600:
+        return f"{seconds // 60} min {seconds % 60} s"
+    return f"{seconds // 3600} h {seconds % 3600 // 60} min"
+
+
+class WfsFeedback(QgsFeedback):
+    """QgsFeedback that also counts what a WFS download has done so far.
+
+    The fraction done is tiles completed for area queries, otherwise features
+    decoded against the sum of numberMatched reported by the server.
+    statusChanged is emitted at most every REPORT_INTERVAL seconds from the
+    downloading threads; status_text() describes the current state.
+    """
+
+    REPORT_INTERVAL = 0.25
+
+    statusChanged = pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.start_time = time.monotonic()
+        self.last_report = 0
+        self.bytes = 0
+        self.features = 0
+        self.pages = 0
+        self.expected_features = 0
+        self.tiles = 0
+        self.tiles_done = 0
+
+    def add_bytes(self, count):
+        with self.lock:
+            self.bytes += count
+
+    def add_features(self, count=1):
+        with self.lock:
+            self.features += count
+        self.report()
+
+    def expect_features(self, count):
+        with self.lock:
+            self.expected_features += count
+        self.report(force=True)
+
+    def page_done(self):
+        with self.lock:
+            self.pages += 1
+        self.report(force=True)
+
+    def expect_tiles(self, count):
+        with self.lock:
+            self.tiles += count
+        self.report(force=True)
+
+    def tile_done(self):
+        with self.lock:
+            self.tiles_done += 1
+        self.report(force=True)
+
+    def fraction(self):
+        """Fraction done between 0 and 1, None while it is unknown"""
+        if self.tiles:
+            return min(1.0, self.tiles_done / self.tiles)
+        if self.expected_features:
+            return min(1.0, self.features / self.expected_features)
+        return None
+
+    def report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_report < self.REPORT_INTERVAL:
+            return
+        self.last_report = now
+        fraction = self.fraction()
+        if fraction is not None:
+            self.setProgress(100 * fraction)
+        self.statusChanged.emit()
+
+    def status_text(self):
+        elapsed = max(time.monotonic() - self.start_time, 0.001)
+        with self.lock:
+            features, expected, tiles, tiles_done, received = self.features, self.expected_features, self.tiles, self.tiles_done, self.bytes
+        if expected and not tiles:
+            parts = [tr(f"{format_count(features)} / {format_count(expected)} elementov")]
+        else:
+            parts = [tr(f"{format_count(features)} elementov")]
+        if tiles:
+            parts.append(tr(f"območje {tiles_done}/{tiles}"))
+        megabytes = f"{received / elapsed / 1e6:.1f}".replace('.', ',')
+        parts.append(tr(f"{format_count(features / elapsed)} el./s, {megabytes} MB/s"))
+        fraction = self.fraction()
+        if fraction is not None:
+            parts.insert(0, f"{100 * fraction:.0f} %")
+        if fraction:
+            parts.append(tr(f"še ~{format_duration(elapsed * (1 - fraction) / fraction)}"))
+        return ', '.join(parts)
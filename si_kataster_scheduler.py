@@ -0,0 +1,78 @@
+"""
+Single-flight scheduling of background tasks.
+Each channel runs at most one task; an identical request joins the task in flight,
+a different one cancels it. Callbacks of superseded tasks never reach the UI.
+"""
+
+from qgis.core import QgsApplication, QgsMessageLog, Qgis
+
+
+MESSAGE_CATEGORY = 'SiKataster'
+
+
+class Flight:
+    """A request on a channel. Only the task id is kept, the task manager
+    deletes finished tasks and their Python wrappers go stale."""
+
+    def __init__(self, key):
+        self.key = key
+        self.task_id = None
+        self.done = False
+
+    def finish(self):
+        self.done = True
+
+    def active(self):
+        return self.task_id is not None and not self.done
+
+    def cancel(self):
+        task = QgsApplication.taskManager().task(self.task_id) if self.active() else None
+        if task is not None:
+            task.cancel()
+
+
+class TaskScheduler:
+    """Coalesces and supersedes tasks per channel, e.g. 'parcels'"""
+
+    def __init__(self):
+        self.flights = {}
+
+    def submit(self, channel, key, factory):
+        """Start the task for key on channel unless it is already in flight.
+
+        factory(deliver) builds the task; wrap every callback or signal slot
+        that touches the UI with deliver(slot) so it only runs while this
+        request is the newest on the channel. Returns the id of the task in flight.
+        """
+        current = self.flights.get(channel)
+        if current is not None and current.active():
+            if current.key == key:
+                return current.task_id
+            QgsMessageLog.logMessage(f"{channel}: zahteva {current.key} zamenjana z {key}", MESSAGE_CATEGORY, Qgis.Info)
+            current.cancel()
+
+        flight = Flight(key)
+        self.flights[channel] = flight
+        task = factory(lambda slot: self._deliver(channel, flight, slot))
+        task.taskCompleted.connect(flight.finish)
+        task.taskTerminated.connect(flight.finish)
+        flight.task_id = QgsApplication.taskManager().addTask(task)
+        return flight.task_id
+
+    def cancel(self, channel):
+        flight = self.flights.pop(channel, None)
+        if flight is not None:
+            flight.cancel()
+
+    def cancel_all(self):
+        for channel in list(self.flights):
+            self.cancel(channel)
+
+    def _deliver(self, channel, flight, slot):
+        def deliver(*args):
+            if self.flights.get(channel) is flight:
+                slot(*args)
+        return deliver
+
+
+task_scheduler = TaskScheduler()
@@ -1,18 +1,33 @@
-from qgis.PyQt.QtWidgets import QWidget, QDialog,QVBoxLayout, QLabel, QLineEdit, QCompleter, QPushButton, QSlider, QHBoxLayout, QStackedWidget, QComboBox,QCheckBox, QDoubleSpinBox, QMenu, QAction
-from qgis.PyQt.QtCore import QStringListModel, Qt, QPoint
+from qgis.PyQt.QtWidgets import QWidget, QDialog,QVBoxLayout, QLabel, QLineEdit, QCompleter, QPushButton, QSlider, QHBoxLayout, QStackedWidget, QComboBox,QCheckBox, QDoubleSpinBox, QMenu, QAction, QFileDialog
+from qgis.PyQt.QtCore import Qt, QPoint
 from qgis.PyQt.QtGui import QCursor
+from qgis.PyQt import sip
 
 from qgis.utils import iface
 from qgis.core import QgsProject
-from qgis.core import QgsCoordinateReferenceSystem, QgsVectorLayer, QgsMessageLog, Qgis, QgsAbstractMetadataBase, QgsApplication, QgsTask, QgsMessageLog, QgsFeatureRequest, QgsProcessingFeatureSourceDefinition
+from qgis.core import QgsCoordinateReferenceSystem, QgsVectorLayer, QgsMessageLog, Qgis, QgsAbstractMetadataBase, QgsApplication, QgsTask, QgsMessageLog, QgsFeatureRequest
 
 import processing
 import keyring
 from .functions_container import (LoadKoTask, 
                                   LoadParcelsTask,
                                   FindParcelTask,
-                                  is_wfs_accessible, 
-                                  FetchByAreaTask)
+                                  FetchByAreaTask,
+                                  MirrorKoTask,
+                                  ImportSnapshotTask,
+                                  BatchParcelTask,
+                                  read_parcel_pairs_csv,
+                                  read_parcel_pairs_layer,
+                                  cached_ko_directory,
+                                  ko_directory_is_fresh)
+from .si_kataster_cache import wfs_cache
+from .si_kataster_health import health_monitor
+from .si_kataster_journal import download_journals
+from .si_kataster_ko_index import KoSearchIndex, KoCompleterModel
+from .si_kataster_parcels import ParcelCompleterModel, parcel_number_cache
+from .si_kataster_scheduler import task_scheduler
+from .si_kataster_mirror import parcel_mirror, local_store_for_ko
+from .si_kataster_settings import setting_value, set_setting_value
 from .si_kataster_esodstvo import (check_esodstvo_credentials, EsodstvoCredentialsDialog,
                                    FetchZKPdfTask, DownloadFolderDialog)
         
@@ -62,20 +77,24 @@ class ParcelDialog(QWidget):
         parcel_search_layout.addWidget(self.ko_id_label)
         parcel_search_layout.addWidget(self.ko_id_input)
 
-        self.ko_completer = QCompleter([], self)
-        self.ko_completer.setCaseSensitivity(Qt.CaseInsensitive)
-        self.ko_completer.setFilterMode(Qt.MatchContains)
+        # The model ranks the matches itself, the completer only shows them
+        self.ko_model = KoCompleterModel(self)
+        self.ko_completer = QCompleter(self.ko_model, self)
+        self.ko_completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
         self.ko_id_input.setCompleter(self.ko_completer)
+        self.ko_id_input.textEdited.connect(self.search_ko)
 
         self.parcela_label = QLabel(self.tr('Številka parcele:'))
         self.parcela_input = QLineEdit()
         parcel_search_layout.addWidget(self.parcela_label)
         parcel_search_layout.addWidget(self.parcela_input)
 
-        self.parcela_completer = QCompleter([], self)
-        self.parcela_completer.setCaseSensitivity(Qt.CaseInsensitive)
-        self.parcela_completer.setFilterMode(Qt.MatchStartsWith)
+        # Matches come from the prefix index of the selected KO
+        self.parcela_model = ParcelCompleterModel(self)
+        self.parcela_completer = QCompleter(self.parcela_model, self)
+        self.parcela_completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
         self.parcela_input.setCompleter(self.parcela_completer)
+        self.parcela_input.textEdited.connect(self.search_parcel)
 
         self.loading_label = QLabel(self.tr('Nalaganje...'))
         self.loading_label.setVisible(False)
@@ -103,6 +122,14 @@ class ParcelDialog(QWidget):
         # Add the horizontal button layout to the parcel_search_widget layout
         parcel_search_layout.addLayout(button_layout)
 
+        # "Seznam parcel" button, loads many parcels from a CSV file or a layer
+        self.batch_button = QPushButton(self.tr('Naloži seznam parcel'))
+        batch_menu = QMenu(self.batch_button)
+        batch_menu.addAction(self.tr('Iz CSV datoteke...'), self.load_parcel_list_from_csv)
+        batch_menu.addAction(self.tr('Iz atributne tabele izbranega sloja'), self.load_parcel_list_from_layer)
+        self.batch_button.setMenu(batch_menu)
+        parcel_search_layout.addWidget(self.batch_button)
+
         self.parcel_search_widget.setLayout(parcel_search_layout)
 
         self.stacked_widget.addWidget(self.parcel_search_widget)
@@ -162,12 +189,28 @@ class ParcelDialog(QWidget):
         self.layer_combobox.currentIndexChanged.connect(self.on_layer_selection_change)
     
 
-        if not is_wfs_accessible():
+        health_monitor.availabilityChanged.connect(self.on_wfs_availability_changed)
+        health_monitor.start()
+        self.load_ko()
+
+    def on_wfs_availability_changed(self, available):
+        if not available:
             self.loading_label.setText(self.tr('Server ni dostopen.'))
             self.loading_label.setVisible(True)
             self.loading_label.setStyleSheet("color: red;")
-        else:
-            self.load_ko()
+        elif self.loading_label.text() == self.tr('Server ni dostopen.'):
+            self.loading_label.setVisible(False)
+
+    def wfs_unavailable(self):
+        """True if the WFS is down and the KO in the KO field is not stored locally"""
+        if health_monitor.is_available():
+            return False
+        if local_store_for_ko(self.ko_id_input.text().split(" - ")[0]) is not None:
+            return False
+        self.loading_label.setText(self.tr('Server ni dostopen.'))
+        self.loading_label.setVisible(True)
+        self.loading_label.setStyleSheet("color: red;")
+        return True
 
     def show_context_menu(self, position):
         """Show context menu for the entire panel"""
@@ -180,6 +223,41 @@ class ParcelDialog(QWidget):
         change_folder_action = QAction(self.tr("Spremeni mapo za prenose"), self)
         change_folder_action.triggered.connect(self.change_download_folder)
         menu.addAction(change_folder_action)
+
+        mirror_ko_action = QAction(self.tr("Shrani izbrano K. O. lokalno"), self)
+        mirror_ko_action.triggered.connect(self.mirror_selected_ko)
+        menu.addAction(mirror_ko_action)
+
+        refresh_mirror_action = QAction(self.tr("Osveži lokalno shranjene K. O."), self)
+        refresh_mirror_action.triggered.connect(self.refresh_mirror)
+        refresh_mirror_action.setEnabled(bool(parcel_mirror.mirrored_kos()))
+        menu.addAction(refresh_mirror_action)
+
+        remove_mirror_action = QAction(self.tr("Izbriši lokalno shranjene K. O."), self)
+        remove_mirror_action.triggered.connect(self.remove_mirror)
+        remove_mirror_action.setEnabled(bool(parcel_mirror.mirrored_kos()))
+        menu.addAction(remove_mirror_action)
+
+        output_menu = menu.addMenu(self.tr("Shranjevanje rezultatov"))
+        current_format = setting_value('output/format')
+        for output_format, label in (('memory', self.tr("Začasni sloj")), ('GPKG', "GeoPackage"), ('FlatGeobuf', "FlatGeobuf")):
+            format_action = QAction(label, self)
+            format_action.setCheckable(True)
+            format_action.setChecked(output_format == current_format)
+            format_action.triggered.connect(lambda checked, output_format=output_format: self.set_output_format(output_format))
+            output_menu.addAction(format_action)
+        output_menu.addSeparator()
+        output_folder_action = QAction(self.tr("Mapa za rezultate..."), self)
+        output_folder_action.triggered.connect(self.choose_output_folder)
+        output_menu.addAction(output_folder_action)
+
+        import_snapshot_action = QAction(self.tr("Uvozi državni posnetek parcel..."), self)
+        import_snapshot_action.triggered.connect(self.import_snapshot)
+        menu.addAction(import_snapshot_action)
+
+        clear_cache_action = QAction(self.tr("Počisti predpomnilnik WFS"), self)
+        clear_cache_action.triggered.connect(self.clear_wfs_cache)
+        menu.addAction(clear_cache_action)
         
         # Show menu at cursor position
         menu.exec_(self.mapToGlobal(position))
@@ -194,6 +272,74 @@ class ParcelDialog(QWidget):
             self.loading_label.setStyleSheet("color: green;")
             self.loading_label.setVisible(True)
 
+    def mirror_selected_ko(self):
+        """Store the KO from the KO field in the local GeoPackage mirror"""
+        ko_id = self.ko_id_input.text().split(" - ")[0].strip()
+        if not ko_id.isdigit():
+            self.loading_label.setStyleSheet("color: black;")
+            self.loading_label.setText(self.tr('Potrebno je vnesti K. O.'))
+            self.loading_label.setVisible(True)
+            return
+        self.start_mirror_task([ko_id])
+
+    def refresh_mirror(self):
+        self.start_mirror_task(list(parcel_mirror.mirrored_kos()))
+
+    def start_mirror_task(self, ko_ids):
+        self.loading_label.setText(self.tr('Shranjujem parcele lokalno...'))
+        self.loading_label.setStyleSheet("color: black;")
+        self.loading_label.setVisible(True)
+        self.mirror_ko_task = MirrorKoTask(description=self.tr('Lokalno shranjevanje K. O.'), ko_ids=ko_ids, loading_label=self.loading_label)
+        QgsApplication.taskManager().addTask(self.mirror_ko_task)
+
+    def set_output_format(self, output_format):
+        """Store results as temporary layers ('memory') or as GPKG/FlatGeobuf files"""
+        if output_format != 'memory' and not setting_value('output/folder'):
+            if not self.choose_output_folder():
+                return
+        set_setting_value('output/format', output_format)
+
+    def choose_output_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, self.tr("Izberi mapo za rezultate"), setting_value('output/folder'))
+        if folder:
+            set_setting_value('output/folder', folder)
+        return bool(folder)
+
+    def output_target(self):
+        """Keyword arguments selecting the output of result layers for a task"""
+        return {'output_format': setting_value('output/format'), 'output_folder': setting_value('output/folder')}
+
+    def import_snapshot(self):
+        """Import a GURS bulk download of all parcels as the local parcel store"""
+        source_path, _ = QFileDialog.getOpenFileName(
+            self,
+            self.tr("Izberi datoteko parcel GURS"),
+            "",
+            self.tr("Vektorske datoteke (*.zip *.shp *.gpkg *.fgb)")
+        )
+        if not source_path:
+            return
+        self.loading_label.setText(self.tr('Uvažam posnetek parcel...'))
+        self.loading_label.setStyleSheet("color: black;")
+        self.loading_label.setVisible(True)
+        self.import_snapshot_task = ImportSnapshotTask(description=self.tr('Uvoz državnega posnetka parcel'), source_path=source_path, loading_label=self.loading_label)
+        QgsApplication.taskManager().addTask(self.import_snapshot_task)
+
+    def remove_mirror(self):
+        parcel_mirror.remove_all()
+        self.loading_label.setText(self.tr('Lokalno shranjene K. O. izbrisane'))
+        self.loading_label.setStyleSheet("color: green;")
+        self.loading_label.setVisible(True)
+
+    def clear_wfs_cache(self):
+        """Delete all cached WFS responses"""
+        wfs_cache.clear()
+        parcel_number_cache.clear()
+        download_journals.clear()
+        self.loading_label.setText(self.tr('Predpomnilnik počiščen'))
+        self.loading_label.setStyleSheet("color: green;")
+        self.loading_label.setVisible(True)
+
     def show_zk_context_menu(self, position):
         """Show context menu for ZK button (deprecated - now handled by panel context menu)"""
         self.show_context_menu(position)
@@ -280,26 +426,46 @@ class ParcelDialog(QWidget):
     def fetch_to_layer(self):
         self.selected_layer = self.layer_combobox.currentData()
         self.buffer_value = self.buffer_spinbox.value()
+        # the selection is captured here on the main thread, the layer must still exist
+        if self.selected_layer is None or sip.isdeleted(self.selected_layer):
+            self.loading_label.setStyleSheet("color: red;")
+            self.loading_label.setText(self.tr('Izberi sloj za presek.'))
+            self.loading_label.setVisible(True)
+            return
         self.loading_label.setText(self.tr('Iskanje parcel...'))
         self.loading_label.setVisible(True)
         self.loading_label.setStyleSheet("color: black;")
 
-        if self.selected_features_checkbox.isChecked():
-            self.selected_layer = QgsProcessingFeatureSourceDefinition(self.selected_layer.id(), True)
-   
-        self.fetch_by_area_task = FetchByAreaTask(description=self.tr('Izberi po območju, naloži sloj'), layer=self.selected_layer, buffer=self.buffer_value, loading_label=self.loading_label)
+        self.fetch_by_area_task = FetchByAreaTask(description=self.tr('Izberi po območju, naloži sloj'), layer=self.selected_layer, buffer=self.buffer_value,
+                                                  selected_only=self.selected_features_checkbox.isChecked(), loading_label=self.loading_label,
+                                                  **self.output_target())
         QgsApplication.taskManager().addTask(self.fetch_by_area_task)
 
 
     def load_ko(self):
-        self.loading_label.setVisible(True)
-        self.load_ko_task = LoadKoTask(description=self.tr('Branje ko-jev'), callback=self.update_ko_completer)
+        # Serve the cached directory right away, refresh it in the background once the TTL runs out
+        self.ko_dict = {}
+        self.update_ko_completer(cached_ko_directory())
+        if self.ko_dict and ko_directory_is_fresh():
+            return
+        if not self.ko_dict:
+            self.loading_label.setVisible(True)
+        self.load_ko_task = LoadKoTask(description=self.tr('Branje ko-jev'), callback=self.update_ko_completer, current=self.ko_dict)
         QgsApplication.taskManager().addTask(self.load_ko_task)
    
     def update_ko_completer(self, ko_dict):
         self.loading_label.setVisible(False)
-        combined_list = [f"{ko_id} - {ko_dict[ko_id]}" for ko_id in ko_dict]
-        self.ko_completer.setModel(QStringListModel(combined_list))
+        if ko_dict is None:
+            return
+        self.ko_dict = ko_dict
+        self.ko_model.set_index(KoSearchIndex(ko_dict))
+
+    def search_ko(self, text):
+        self.ko_model.set_query(text)
+        if self.ko_model.rowCount():
+            self.ko_completer.complete()
+        else:
+            self.ko_completer.popup().hide()
 
     def load_parcels_for_selected_ko(self):
         ko_id_text = self.ko_id_input.text()
@@ -310,26 +476,32 @@ class ParcelDialog(QWidget):
             self.loading_label.setStyleSheet("color: black;")
             self.loading_label.setVisible(True)
 
-            self.load_parcels_task = LoadParcelsTask(description=self.tr('Branje parcel'), ko_id=ko_id, callback=self.update_parcel_completer)
-            QgsApplication.taskManager().addTask(self.load_parcels_task)
+            task_scheduler.submit('parcels', ko_id, lambda deliver: self.create_load_parcels_task(ko_id, deliver))
+
+    def create_load_parcels_task(self, ko_id, deliver):
+        task = LoadParcelsTask(description=self.tr('Branje parcel'), ko_id=ko_id, callback=deliver(self.update_parcel_completer))
+        task.parcelsLoaded.connect(deliver(self.parcela_model.set_index))
+        return task
 
-    def update_parcel_completer(self, parcel_list):
+    def update_parcel_completer(self, parcel_index):
         self.loading_label.setVisible(False)
-        if len(parcel_list) == 0:
+        self.parcela_model.set_index(parcel_index)
+        if len(parcel_index) == 0:
             self.loading_label.setStyleSheet("color: red;")
             self.loading_label.setText(self.tr('Ne najdem parcel za K. O.'))
+            self.loading_label.setVisible(True)
+
+    def search_parcel(self, text):
+        self.parcela_model.set_query(text)
+        if self.parcela_model.rowCount():
+            self.parcela_completer.complete()
         else:
-            parcel_ids = [parcel for parcel in parcel_list]
-            self.parcela_completer.setModel(QStringListModel(parcel_ids))
+            self.parcela_completer.popup().hide()
 
 
 
     def find_parcel(self):
-        if not is_wfs_accessible():
-            self.loading_label.setText(self.tr('Server ni dostopen.'))
-            self.loading_label.setVisible(True)
-            self.loading_label.setStyleSheet("color: red;")
-        else:
+        if not self.wfs_unavailable():
             self.loading_label.setVisible(False)
             ko_id_or_naziv = self.ko_id_input.text()
             parcela = self.parcela_input.text()
@@ -344,17 +516,13 @@ class ParcelDialog(QWidget):
                 self.loading_label.setVisible(True)
 
     def load_parcel(self):
-        if not is_wfs_accessible():
-            self.loading_label.setText(self.tr('Server ni dostopen.'))
-            self.loading_label.setVisible(True)
-            self.loading_label.setStyleSheet("color: red;")
-        else:
+        if not self.wfs_unavailable():
             self.loading_label.setVisible(False)
             ko_id_or_naziv = self.ko_id_input.text()
             parcela = self.parcela_input.text()
             if ko_id_or_naziv and parcela:
                 ko_id = ko_id_or_naziv.split(" - ")[0]
-                self.load_parcel_task= FindParcelTask(description=self.tr('Naloži'),iface=self.iface, loading_label=self.loading_label, ko_id=ko_id, parcela=parcela)
+                self.load_parcel_task= FindParcelTask(description=self.tr('Naloži'),iface=self.iface, loading_label=self.loading_label, ko_id=ko_id, parcela=parcela, **self.output_target())
                 QgsApplication.taskManager().addTask(self.load_parcel_task)
            
             else:
@@ -362,6 +530,43 @@ class ParcelDialog(QWidget):
                 self.loading_label.setText(self.tr('Potrebno je vnesti K. O. in parcelo'))  
                 self.loading_label.setVisible(True)
 
+    def load_parcel_list_from_csv(self):
+        csv_file, _ = QFileDialog.getOpenFileName(self, self.tr("Izberi seznam parcel"), "", self.tr("CSV datoteke (*.csv *.txt)"))
+        if csv_file:
+            try:
+                pairs = read_parcel_pairs_csv(csv_file)
+            except (OSError, UnicodeDecodeError) as e:
+                self.show_batch_error(str(e))
+                return
+            self.start_batch_parcel_task(pairs)
+
+    def load_parcel_list_from_layer(self):
+        layer = self.iface.activeLayer()
+        if not isinstance(layer, QgsVectorLayer):
+            self.show_batch_error(self.tr('Izberite sloj s polji KO_ID in ST_PARCELE'))
+            return
+        try:
+            pairs = read_parcel_pairs_layer(layer, selected_only=layer.selectedFeatureCount() > 0)
+        except ValueError as e:
+            self.show_batch_error(str(e))
+            return
+        self.start_batch_parcel_task(pairs)
+
+    def start_batch_parcel_task(self, pairs):
+        if not pairs:
+            self.show_batch_error(self.tr('Seznam ne vsebuje parov K. O. in parcele'))
+            return
+        self.loading_label.setText(self.tr(f'Iskanje {len(pairs)} parcel...'))
+        self.loading_label.setStyleSheet("color: black;")
+        self.loading_label.setVisible(True)
+        self.batch_parcel_task = BatchParcelTask(description=self.tr('Nalaganje seznama parcel'), pairs=pairs, loading_label=self.loading_label)
+        QgsApplication.taskManager().addTask(self.batch_parcel_task)
+
+    def show_batch_error(self, message):
+        self.loading_label.setStyleSheet("color: red;")
+        self.loading_label.setText(message)
+        self.loading_label.setVisible(True)
+
     def load_zk_pdf(self):
         saved_username = keyring.get_password("SiKataster", "esodstvo_username")    
         saved_password = keyring.get_password("SiKataster", "esodstvo_password")
@@ -0,0 +1,50 @@
+import os
+
+from qgis.core import QgsApplication, QgsSettings
+
+
+SETTINGS_GROUP = 'SiKataster'
+
+# Tunables of the WFS fetch pipeline, overridable in QGIS settings under SiKataster/
+DEFAULTS = {
+    'wfs/max_workers': 4,
+    'area/tile_size_m': 2000.0,
+    'output/format': 'memory',
+    'output/folder': '',
+    'http/retries': 3,
+    'http/backoff': 0.5,
+    'http/backoff_max': 8.0,
+    'http/rate_per_s': 5.0,
+    'http/burst': 10,
+    'http/max_concurrent': 6,
+    'breaker/failures': 3,
+    'breaker/reset_s': 30,
+    'health/interval_s': 60,
+    'cache/enabled': True,
+    'cache/ttl_hours': 24.0,
+    'cache/max_mb': 200,
+    'ko/ttl_hours': 24.0,
+    'parcels/ttl_hours': 168.0,
+    'journal/max_age_hours': 72.0,
+}
+
+
+def setting_value(key, value_type=None):
+    """Read a plugin setting, falling back to the default from DEFAULTS."""
+    default = DEFAULTS.get(key)
+    if value_type is None and default is not None:
+        value_type = type(default)
+    if value_type is None:
+        return QgsSettings().value(f'{SETTINGS_GROUP}/{key}', default)
+    return QgsSettings().value(f'{SETTINGS_GROUP}/{key}', default, type=value_type)
+
+
+def set_setting_value(key, value):
+    QgsSettings().setValue(f'{SETTINGS_GROUP}/{key}', value)
+
+
+def plugin_profile_dir(*parts):
+    """Directory inside the active QGIS user profile for plugin data, created on demand."""
+    path = os.path.join(QgsApplication.qgisSettingsDirPath(), SETTINGS_GROUP, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path